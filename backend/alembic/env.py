@@ -44,7 +44,10 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            # Commit each migration separately so CONCURRENTLY steps run on committed tables
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
@@ -1,4 +1,4 @@
-"""Initial migration
+"""Initial migration (tables only; indexes are built in 001b_initial_indexes)
 
 Revision ID: 001_initial
 Revises: 
@@ -46,7 +46,6 @@ def upgrade() -> None:
         sa.Column('filepath', sa.String(), nullable=False),
         sa.Column('uploaded_at', sa.DateTime(), nullable=False),
     )
-    op.create_index('ix_documents_year', 'documents', ['year'], unique=False)
     
     # Create pages table
     op.create_table(
@@ -56,7 +55,6 @@ def upgrade() -> None:
         sa.Column('page_number', sa.Integer(), nullable=False),
         sa.Column('text_raw', sa.Text(), nullable=False),
     )
-    op.create_index('ix_pages_document_id', 'pages', ['document_id'], unique=False)
     
     # Create sections table
     op.create_table(
@@ -67,7 +65,6 @@ def upgrade() -> None:
         sa.Column('page_start', sa.Integer(), nullable=False),
         sa.Column('page_end', sa.Integer(), nullable=False),
     )
-    op.create_index('ix_sections_document_id', 'sections', ['document_id'], unique=False)
     
     # Create budget_items table
     op.create_table(
@@ -85,10 +82,6 @@ def upgrade() -> None:
         sa.Column('explanation', sa.Text(), nullable=False),
         sa.Column('created_at', sa.DateTime(), nullable=False),
     )
-    op.create_index('ix_budget_items_document_id', 'budget_items', ['document_id'], unique=False)
-    op.create_index('ix_budget_items_year', 'budget_items', ['year'], unique=False)
-    op.create_index('ix_budget_items_side', 'budget_items', ['side'], unique=False)
-    op.create_index('ix_budget_items_category', 'budget_items', ['category'], unique=False)
     
     # Create import_jobs table
     op.create_table(
@@ -100,22 +93,13 @@ def upgrade() -> None:
         sa.Column('error_message', sa.Text(), nullable=True),
         sa.Column('created_at', sa.DateTime(), nullable=False),
     )
-    op.create_index('ix_import_jobs_document_id', 'import_jobs', ['document_id'], unique=False)
 
 
 def downgrade() -> None:
-    op.drop_index('ix_import_jobs_document_id', table_name='import_jobs')
     op.drop_table('import_jobs')
-    op.drop_index('ix_budget_items_category', table_name='budget_items')
-    op.drop_index('ix_budget_items_side', table_name='budget_items')
-    op.drop_index('ix_budget_items_year', table_name='budget_items')
-    op.drop_index('ix_budget_items_document_id', table_name='budget_items')
     op.drop_table('budget_items')
-    op.drop_index('ix_sections_document_id', table_name='sections')
     op.drop_table('sections')
-    op.drop_index('ix_pages_document_id', table_name='pages')
     op.drop_table('pages')
-    op.drop_index('ix_documents_year', table_name='documents')
     op.drop_table('documents')
     
     # Drop enum types
@@ -0,0 +1,46 @@
+"""Create initial indexes concurrently
+
+Revision ID: 001b_initial_indexes
+Revises: 001_initial
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '001b_initial_indexes'
+down_revision = '001_initial'
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_documents_year', 'documents', ['year']),
+    ('ix_pages_document_id', 'pages', ['document_id']),
+    ('ix_sections_document_id', 'sections', ['document_id']),
+    ('ix_budget_items_document_id', 'budget_items', ['document_id']),
+    ('ix_budget_items_year', 'budget_items', ['year']),
+    ('ix_budget_items_side', 'budget_items', ['side']),
+    ('ix_budget_items_category', 'budget_items', ['category']),
+    ('ix_import_jobs_document_id', 'import_jobs', ['document_id']),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block, and does not
+    # block writes when this baseline is replayed against an already-populated database
+    with op.get_context().autocommit_block():
+        # Let PostgreSQL (11+) parallelize the B-tree sorts. Session-level SET, since
+        # SET LOCAL has no effect outside a transaction block.
+        op.execute("SET max_parallel_maintenance_workers = 4")
+        op.execute("SET maintenance_work_mem = '256MB'")
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+        op.execute("RESET maintenance_work_mem")
+        op.execute("RESET max_parallel_maintenance_workers")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -1,7 +1,7 @@
 """Add archived field to documents
 
 Revision ID: 002_add_archived
-Revises: 001_initial
+Revises: 001b_initial_indexes
 Create Date: 2024-01-01 00:00:00.000000
 
 """
@@ -10,7 +10,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '002_add_archived'
-down_revision = '001_initial'
+down_revision = '001b_initial_indexes'
 branch_labels = None
 depends_on = None
 
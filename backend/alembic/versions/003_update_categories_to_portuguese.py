@@ -15,101 +15,41 @@ down_revision = '002_add_archived'
 branch_labels = None
 depends_on = None
 
+# (English, Portuguese) category labels
+CATEGORY_RENAMES = [
+    ('Personal taxes', 'Impostos sobre pessoas'),
+    ('Corporate taxes', 'Impostos sobre empresas'),
+    ('Taxes on purchases', 'Impostos sobre compras'),
+    ('Social security contributions', 'Contribuições para segurança social'),
+    ('Other revenue', 'Outras receitas'),
+    ('Health', 'Saúde'),
+    ('Education', 'Educação'),
+    ('Pensions & social support', 'Pensões e apoio social'),
+    ('Running the government', 'Funcionamento do governo'),
+    ('Security & defense', 'Segurança e defesa'),
+    ('Justice', 'Justiça'),
+    ('Infrastructure & environment', 'Infraestrutura e ambiente'),
+    ('Public debt', 'Dívida pública'),
+]
+
+
+def _rename_category_values(mapping) -> None:
+    """
+    Rename categoryenum labels in place.
+    
+    ALTER TYPE ... RENAME VALUE (PostgreSQL 10+) only updates pg_enum, so rows
+    in budget_items are neither rewritten nor locked. Renaming values is allowed
+    inside the migration transaction (unlike ADD VALUE on older versions).
+    """
+    for old, new in mapping:
+        op.execute(f"ALTER TYPE categoryenum RENAME VALUE '{old}' TO '{new}'")
+
 
 def upgrade() -> None:
     # Update category enum values to Portuguese
-    # First, update existing data
-    op.execute("""
-        UPDATE budget_items 
-        SET category = CASE category
-            WHEN 'Personal taxes' THEN 'Impostos sobre pessoas'
-            WHEN 'Corporate taxes' THEN 'Impostos sobre empresas'
-            WHEN 'Taxes on purchases' THEN 'Impostos sobre compras'
-            WHEN 'Social security contributions' THEN 'Contribuições para segurança social'
-            WHEN 'Other revenue' THEN 'Outras receitas'
-            WHEN 'Health' THEN 'Saúde'
-            WHEN 'Education' THEN 'Educação'
-            WHEN 'Pensions & social support' THEN 'Pensões e apoio social'
-            WHEN 'Running the government' THEN 'Funcionamento do governo'
-            WHEN 'Security & defense' THEN 'Segurança e defesa'
-            WHEN 'Justice' THEN 'Justiça'
-            WHEN 'Infrastructure & environment' THEN 'Infraestrutura e ambiente'
-            WHEN 'Public debt' THEN 'Dívida pública'
-            ELSE category
-        END
-    """)
-    
-    # Drop old enum and create new one
-    op.execute('ALTER TYPE categoryenum RENAME TO categoryenum_old')
-    
-    # Create new enum with Portuguese values
-    op.execute("""
-        CREATE TYPE categoryenum AS ENUM (
-            'Impostos sobre pessoas',
-            'Impostos sobre empresas',
-            'Impostos sobre compras',
-            'Contribuições para segurança social',
-            'Outras receitas',
-            'Saúde',
-            'Educação',
-            'Pensões e apoio social',
-            'Funcionamento do governo',
-            'Segurança e defesa',
-            'Justiça',
-            'Infraestrutura e ambiente',
-            'Dívida pública'
-        )
-    """)
-    
-    # Update column to use new enum
-    op.execute('ALTER TABLE budget_items ALTER COLUMN category TYPE categoryenum USING category::text::categoryenum')
-    
-    # Drop old enum
-    op.execute('DROP TYPE categoryenum_old')
+    _rename_category_values(CATEGORY_RENAMES)
 
 
 def downgrade() -> None:
     # Revert to English categories
-    op.execute("""
-        UPDATE budget_items 
-        SET category = CASE category
-            WHEN 'Impostos sobre pessoas' THEN 'Personal taxes'
-            WHEN 'Impostos sobre empresas' THEN 'Corporate taxes'
-            WHEN 'Impostos sobre compras' THEN 'Taxes on purchases'
-            WHEN 'Contribuições para segurança social' THEN 'Social security contributions'
-            WHEN 'Outras receitas' THEN 'Other revenue'
-            WHEN 'Saúde' THEN 'Health'
-            WHEN 'Educação' THEN 'Education'
-            WHEN 'Pensões e apoio social' THEN 'Pensions & social support'
-            WHEN 'Funcionamento do governo' THEN 'Running the government'
-            WHEN 'Segurança e defesa' THEN 'Security & defense'
-            WHEN 'Justiça' THEN 'Justice'
-            WHEN 'Infraestrutura e ambiente' THEN 'Infrastructure & environment'
-            WHEN 'Dívida pública' THEN 'Public debt'
-            ELSE category
-        END
-    """)
-    
-    op.execute('ALTER TYPE categoryenum RENAME TO categoryenum_old')
-    
-    op.execute("""
-        CREATE TYPE categoryenum AS ENUM (
-            'Personal taxes',
-            'Corporate taxes',
-            'Taxes on purchases',
-            'Social security contributions',
-            'Other revenue',
-            'Health',
-            'Education',
-            'Pensions & social support',
-            'Running the government',
-            'Security & defense',
-            'Justice',
-            'Infrastructure & environment',
-            'Public debt'
-        )
-    """)
-    
-    op.execute('ALTER TABLE budget_items ALTER COLUMN category TYPE categoryenum USING category::text::categoryenum')
-    op.execute('DROP TYPE categoryenum_old')
-
+    _rename_category_values([(pt, en) for en, pt in CATEGORY_RENAMES])
@@ -0,0 +1,52 @@
+"""Replace single-column side/category indexes with composite indexes
+
+Revision ID: 004_budget_items_composite_idx
+Revises: 003_portuguese_categories
+Create Date: 2024-01-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004_budget_items_composite_idx'
+down_revision = '003_portuguese_categories'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so writes to budget_items continue during the build
+    with op.get_context().autocommit_block():
+        # Parallel B-tree builds (PostgreSQL 11+), see 001b_initial_indexes
+        op.execute("SET max_parallel_maintenance_workers = 4")
+        op.execute("SET maintenance_work_mem = '256MB'")
+        op.create_index(
+            'ix_budget_items_year_side_category', 'budget_items', ['year', 'side', 'category'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_budget_items_doc_side', 'budget_items', ['document_id', 'side'],
+            unique=False, postgresql_concurrently=True
+        )
+        # Many items have no value; totals only ever read the non-null ones
+        op.create_index(
+            'ix_budget_items_value_notnull', 'budget_items', ['value'],
+            unique=False, postgresql_concurrently=True,
+            postgresql_where=sa.text('value IS NOT NULL')
+        )
+        op.execute("RESET maintenance_work_mem")
+        op.execute("RESET max_parallel_maintenance_workers")
+        
+        # Low-cardinality single-column indexes, covered by the composites above
+        op.drop_index('ix_budget_items_side', table_name='budget_items', postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_category', table_name='budget_items', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_budget_items_side', 'budget_items', ['side'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_budget_items_category', 'budget_items', ['category'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_value_notnull', table_name='budget_items', postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_doc_side', table_name='budget_items', postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_year_side_category', table_name='budget_items', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Add server-side defaults for timestamps and import job progress
+
+Revision ID: 005_server_side_defaults
+Revises: 004_budget_items_composite_idx
+Create Date: 2024-01-04 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005_server_side_defaults'
+down_revision = '004_budget_items_composite_idx'
+branch_labels = None
+depends_on = None
+
+# Columns are naive timestamps holding UTC, so default to UTC rather than server-local time
+UTC_NOW = sa.text("timezone('utc', now())")
+
+TIMESTAMP_COLUMNS = [
+    ('documents', 'uploaded_at'),
+    ('budget_items', 'created_at'),
+    ('import_jobs', 'created_at'),
+]
+
+
+def upgrade() -> None:
+    # Metadata-only changes: existing rows are not rewritten
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=UTC_NOW)
+    op.alter_column('import_jobs', 'progress', server_default='0')
+
+
+def downgrade() -> None:
+    op.alter_column('import_jobs', 'progress', server_default=None)
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=None)
@@ -0,0 +1,70 @@
+"""Store budget item values as BIGINT cents
+
+Revision ID: 006_value_cents
+Revises: 005_server_side_defaults
+Create Date: 2024-01-05 00:00:00.000000
+
+"""
+from alembic import op, context
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_value_cents'
+down_revision = '005_server_side_defaults'
+branch_labels = None
+depends_on = None
+
+# Rows converted per committed batch, to keep row locks short on large tables
+BATCH_SIZE = 10000
+
+
+def _backfill(target: str, expression: str) -> None:
+    """Copy converted values into the new column, committing every BATCH_SIZE rows."""
+    if context.is_offline_mode():
+        op.execute(f"UPDATE budget_items SET {target} = {expression} WHERE value IS NOT NULL")
+        return
+    
+    statement = sa.text(f"""
+        UPDATE budget_items SET {target} = {expression}
+        WHERE id IN (
+            SELECT id FROM budget_items
+            WHERE value IS NOT NULL AND {target} IS NULL
+            LIMIT :batch_size
+        )
+    """)
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while bind.execute(statement, {"batch_size": BATCH_SIZE}).rowcount:
+            pass
+
+
+def _swap_value_column(new_column: sa.Column, expression: str) -> None:
+    """Replace budget_items.value with new_column, converting existing values."""
+    op.add_column('budget_items', new_column)
+    _backfill(new_column.name, expression)
+    
+    # The partial index on value goes away with the column; rebuild it afterwards
+    op.drop_index('ix_budget_items_value_notnull', table_name='budget_items')
+    op.drop_column('budget_items', 'value')
+    op.alter_column('budget_items', new_column.name, new_column_name='value')
+    # Built concurrently (outside the migration transaction) so writes are not blocked
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_budget_items_value_notnull', 'budget_items', ['value'],
+            unique=False, postgresql_where=sa.text('value IS NOT NULL'), postgresql_concurrently=True
+        )
+
+
+def upgrade() -> None:
+    # NUMERIC(20, 2) EUR -> BIGINT cents (fixed-width, integer aggregation)
+    _swap_value_column(
+        sa.Column('value_cents', sa.BigInteger(), nullable=True),
+        'ROUND(value * 100)::bigint',
+    )
+
+
+def downgrade() -> None:
+    _swap_value_column(
+        sa.Column('value_eur', sa.Numeric(20, 2), nullable=True),
+        'value / 100.0',
+    )
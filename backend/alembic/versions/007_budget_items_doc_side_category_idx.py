@@ -0,0 +1,34 @@
+"""Extend the (document_id, side) index with category for summary aggregation
+
+Revision ID: 007_doc_side_category_idx
+Revises: 006_value_cents
+Create Date: 2024-01-06 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '007_doc_side_category_idx'
+down_revision = '006_value_cents'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # Serves the per-document GROUP BY side, category in the summary endpoint
+        op.create_index(
+            'ix_budget_items_doc_side_cat', 'budget_items', ['document_id', 'side', 'category'],
+            unique=False, postgresql_concurrently=True
+        )
+        # Prefix of the index above
+        op.drop_index('ix_budget_items_doc_side', table_name='budget_items', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_budget_items_doc_side', 'budget_items', ['document_id', 'side'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.drop_index('ix_budget_items_doc_side_cat', table_name='budget_items', postgresql_concurrently=True)
@@ -0,0 +1,24 @@
+"""Add size_bytes to documents
+
+Revision ID: 008_document_size_bytes
+Revises: 007_doc_side_category_idx
+Create Date: 2024-01-07 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_document_size_bytes'
+down_revision = '007_doc_side_category_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable: documents uploaded before this revision have no recorded size
+    op.add_column('documents', sa.Column('size_bytes', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'size_bytes')
@@ -0,0 +1,24 @@
+"""Add sha256 checksum to documents
+
+Revision ID: 009_document_sha256
+Revises: 008_document_size_bytes
+Create Date: 2024-01-08 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009_document_sha256'
+down_revision = '008_document_size_bytes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable: documents uploaded before this revision have no checksum
+    op.add_column('documents', sa.Column('sha256', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'sha256')
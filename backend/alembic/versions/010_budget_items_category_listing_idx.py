@@ -0,0 +1,42 @@
+"""Add index-backed sort orders for category listings
+
+Revision ID: 010_category_listing_idx
+Revises: 009_document_sha256
+Create Date: 2024-01-09 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_category_listing_idx'
+down_revision = '009_document_sha256'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # get_category_items filters on (document_id, category) and sorts by
+        # value DESC NULLS LAST or page_number; these make both a plain index scan
+        op.create_index(
+            'ix_budget_items_doc_cat_value', 'budget_items',
+            ['document_id', 'category', sa.text('value DESC NULLS LAST')],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_budget_items_doc_cat_page', 'budget_items', ['document_id', 'category', 'page_number'],
+            unique=False, postgresql_concurrently=True
+        )
+        
+        # Prefixes of ix_budget_items_doc_side_cat / ix_budget_items_year_side_category
+        op.drop_index('ix_budget_items_document_id', table_name='budget_items', postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_year', table_name='budget_items', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_budget_items_year', 'budget_items', ['year'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_budget_items_document_id', 'budget_items', ['document_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_doc_cat_page', table_name='budget_items', postgresql_concurrently=True)
+        op.drop_index('ix_budget_items_doc_cat_value', table_name='budget_items', postgresql_concurrently=True)
@@ -0,0 +1,48 @@
+"""Store timestamps as TIMESTAMPTZ
+
+Revision ID: 011_timestamptz
+Revises: 010_category_listing_idx
+Create Date: 2024-01-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011_timestamptz'
+down_revision = '010_category_listing_idx'
+branch_labels = None
+depends_on = None
+
+TIMESTAMP_COLUMNS = [
+    ('documents', 'uploaded_at'),
+    ('budget_items', 'created_at'),
+    ('import_jobs', 'created_at'),
+]
+
+
+def upgrade() -> None:
+    # Existing values are naive UTC. With the session time zone set to UTC the
+    # plain cast reads them as UTC, and PostgreSQL 12+ changes the type without
+    # rewriting the table.
+    op.execute("SET LOCAL TIME ZONE 'UTC'")
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(timezone=True),
+            existing_type=sa.DateTime(),
+            existing_nullable=False,
+            server_default=sa.text('now()')
+        )
+
+
+def downgrade() -> None:
+    op.execute("SET LOCAL TIME ZONE 'UTC'")
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(),
+            existing_type=sa.DateTime(timezone=True),
+            existing_nullable=False,
+            server_default=sa.text("timezone('utc', now())")
+        )
@@ -0,0 +1,24 @@
+"""Add version counter to documents
+
+Revision ID: 012_document_version
+Revises: 011_timestamptz
+Create Date: 2024-01-11 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012_document_version'
+down_revision = '011_timestamptz'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Constant default: metadata-only on PostgreSQL 11+, no table rewrite
+    op.add_column('documents', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'version')
@@ -0,0 +1,25 @@
+"""Add materialized summary to documents
+
+Revision ID: 013_document_summary_json
+Revises: 012_document_version
+Create Date: 2024-01-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '013_document_summary_json'
+down_revision = '012_document_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NULL until a document finishes processing; the API aggregates live meanwhile
+    op.add_column('documents', sa.Column('summary_json', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'summary_json')
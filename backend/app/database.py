@@ -13,6 +13,9 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# For GET endpoints: nothing is written, so skip flushes and post-commit expiry
+ReadOnlySessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
 Base = declarative_base()
 
 
@@ -24,3 +27,11 @@ def get_db():
     finally:
         db.close()
 
+
+def get_readonly_db():
+    """Dependency for FastAPI to get a database session for read-only endpoints."""
+    db = ReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
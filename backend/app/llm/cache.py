@@ -0,0 +1,122 @@
+"""LLM response caches - exact-match, keyed by provider + model + prompt hash."""
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from typing import Optional
+from loguru import logger
+
+
+def cache_key(namespace: str, prompt: str, system_prompt: str) -> str:
+    """Content-addressed key for a prompt pair within a provider/model namespace."""
+    digest = blake2b(f"{system_prompt}\0{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+    return namespace + digest
+
+
+class LLMCache(ABC):
+    """
+    Abstract base class for response caches.
+    
+    Implementations never raise: backend errors are logged and treated as a
+    miss (get) or ignored (set), so a cache outage never fails an import.
+    """
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None."""
+        pass
+    
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        """Store a response under key."""
+        pass
+
+
+class RedisLLMCache(LLMCache):
+    """Redis-backed cache, shared by all API and Celery worker processes."""
+    
+    def __init__(self, url: str, ttl: int):
+        import redis
+        self.ttl = ttl
+        self._redis = redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+    
+    def get(self, key: str) -> Optional[str]:
+        try:
+            cached = self._redis.get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        return cached.decode("utf-8") if cached is not None else None
+    
+    def set(self, key: str, value: str) -> None:
+        try:
+            self._redis.setex(key, self.ttl, value)
+        except Exception as e:
+            logger.warning(f"LLM cache store failed: {e}")
+
+
+class SQLiteLLMCache(LLMCache):
+    """SQLite-backed cache (WAL mode), for local development without Redis."""
+    
+    def __init__(self, path: str, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        # sqlite3 connections must not be shared across threads
+        self._local = threading.local()
+    
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+    
+    def get(self, key: str) -> Optional[str]:
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        return row[0] if row else None
+    
+    def set(self, key: str, value: str) -> None:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+        except Exception as e:
+            logger.warning(f"LLM cache store failed: {e}")
+
+
+def create_cache(backend: str, **kwargs) -> LLMCache:
+    """
+    Factory function to create the configured response cache.
+    
+    Args:
+        backend: One of 'redis', 'sqlite'
+        **kwargs: Backend-specific configuration
+    
+    Returns:
+        LLMCache instance
+    """
+    backend = backend.lower()
+    
+    if backend == "redis":
+        return RedisLLMCache(url=kwargs["url"], ttl=kwargs["ttl"])
+    elif backend == "sqlite":
+        return SQLiteLLMCache(path=kwargs["path"], ttl=kwargs["ttl"])
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
@@ -1,12 +1,207 @@
 """LLM client for budget item extraction, categorization, and explanation."""
-import json
-from typing import List
+import asyncio
+import re
+import threading
+import ijson
+import orjson
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
 from loguru import logger
 from app.config import settings
 from app.schemas import ExtractResponse, ExtractedItem
 from app.models import SideEnum, CategoryEnum
-from app.llm.providers import create_provider, LLMProvider
+from app.llm.providers import (
+    create_provider, LLMProvider, DisabledProvider, ProviderUnavailable, StreamTimeout, NUM_PREDICT
+)
+from app.llm.cache import cache_key, create_cache, LLMCache
+from app.llm.singleflight import SingleFlight, AsyncSingleFlight
 
+# Category lookups by label, built once (exact and case-insensitive)
+_CATEGORY_BY_VALUE = {c.value: c for c in CategoryEnum}
+_CATEGORY_BY_VALUE_LOWER = {c.value.lower(): c for c in CategoryEnum}
+
+# Markdown code fence around the response (optional language tag, closing fence optional)
+_FENCE_RE = re.compile(r"^\s*```[^\n]*\n(.*?)(?:```|$)", re.DOTALL)
+# Tokens that matter when matching JSON brackets: string literals (skipped whole, escapes included) and brackets
+_JSON_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]', re.DOTALL)
+# Start of a JSON array of objects (or an empty one); a bare "[" may just be prose
+_JSON_ARRAY_START_RE = re.compile(r"\[(?=\s*[{\]])")
+
+
+def _find_json_start(text: str, allow_array: bool = False) -> int:
+    """
+    Index of the first JSON object in text (-1 if none).
+    
+    With allow_array, an array of objects that opens before the first object
+    (small models sometimes drop the {"items": ...} wrapper) counts as well.
+    """
+    start = text.find("{")
+    if allow_array:
+        # endpos past the brace, so the lookahead can see it
+        array = _JSON_ARRAY_START_RE.search(text, 0, start + 1 if start >= 0 else len(text))
+        if array:
+            return array.start()
+    return start
+
+
+def _slice_first_json(text: str, allow_array: bool = False) -> str:
+    """
+    Return the first balanced JSON object in text, ignoring brackets inside strings.
+    
+    Single pass: the regex jumps between brackets and over whole string literals in C,
+    and Python only tracks nesting depth. A truncated value is returned as-is
+    from its opening bracket; text without any object is returned unchanged.
+    """
+    start = _find_json_start(text, allow_array)
+    if start < 0:
+        return text
+    depth = 0
+    for match in _JSON_TOKEN_RE.finditer(text, start):
+        token = match.group()
+        if token == "{" or token == "[":
+            depth += 1
+        elif token == "}" or token == "]":
+            depth -= 1
+            if depth == 0:
+                return text[start:match.end()]
+    return text[start:]
+
+# System prompts are constant (categorize only varies by side), so build them once at import
+_EXTRACT_SYSTEM_PROMPT = """Você é um analisador de documentos orçamentais muito experiente. Extraia itens de linha orçamental do texto fornecido.
+REGRAS CRÍTICAS:
+1. Produza APENAS JSON válido correspondendo a este esquema exato:
+{
+"items": [
+    {
+    "side": "REVENUE" ou "EXPENSE",
+    "descriptionOriginal": "texto exato do documento",
+    "value": número ou null (NÃO invente números, use null se incerto),
+    "unit": "EUR" ou "THOUSAND_EUR" ou "MILLION_EUR" ou "UNKNOWN",
+    "pageNumber": número (a página onde evidenceText aparece),
+    "evidenceText": "excerto literal do texto de entrada (50-200 caracteres)"
+    }
+]
+}
+
+2. NÃO calcule totais nem invente números. Extraia apenas o que vê.
+3. Se um valor não estiver claro ou faltar, defina value como null.
+4. evidenceText deve ser um excerto literal da entrada (copie e cole, não parafraseie).
+5. pageNumber deve corresponder ao marcador de página na entrada (ex: se a evidência está após "--- PAGE 12 ---", use 12).
+6. side deve ser REVENUE ou EXPENSE com base no contexto.
+7. Extraia TODOS os itens orçamentais que encontrar, mesmo que o valor seja null.
+8. IMPORTANTE: Todas as descrições e textos devem estar em português.
+"""
+
+_EXTRACT_BATCH_SYSTEM_PROMPT = """Você é um analisador de documentos orçamentais muito experiente. Extraia itens de linha orçamental do texto fornecido, que contém várias secções.
+REGRAS CRÍTICAS:
+1. Produza APENAS JSON válido correspondendo a este esquema exato:
+{
+"sections": [
+    {
+    "section": número da secção (como no marcador "=== SECÇÃO 1: ... ==="),
+    "items": [
+        {
+        "side": "REVENUE" ou "EXPENSE",
+        "descriptionOriginal": "texto exato do documento",
+        "value": número ou null (NÃO invente números, use null se incerto),
+        "unit": "EUR" ou "THOUSAND_EUR" ou "MILLION_EUR" ou "UNKNOWN",
+        "pageNumber": número (a página onde evidenceText aparece),
+        "evidenceText": "excerto literal do texto de entrada (50-200 caracteres)"
+        }
+    ]
+    }
+]
+}
+
+2. NÃO calcule totais nem invente números. Extraia apenas o que vê.
+3. Se um valor não estiver claro ou faltar, defina value como null.
+4. evidenceText deve ser um excerto literal da entrada (copie e cole, não parafraseie).
+5. pageNumber deve corresponder ao marcador de página na entrada (ex: se a evidência está após "--- PAGE 12 ---", use 12).
+6. side deve ser REVENUE ou EXPENSE com base no contexto.
+7. Extraia TODOS os itens orçamentais que encontrar, mesmo que o valor seja null.
+8. Cada secção começa com "=== SECÇÃO n: título ===". Devolva uma entrada em "sections" por secção, com os itens dessa secção (lista vazia se não tiver itens).
+9. IMPORTANTE: Todas as descrições e textos devem estar em português.
+"""
+
+_EXPLAIN_SYSTEM_PROMPT = """Você é um explicador de documentos orçamentais. Gere explicações claras e factuais para itens orçamentais.
+
+REGRAS:
+1. Escreva apenas 2-3 frases.
+2. Baseie a explicação APENAS no texto de evidência e no contexto da secção.
+3. NÃO adicione opiniões políticas ou especulação.
+4. NÃO invente números além do que está na evidência.
+5. Use linguagem simples que cidadãos comuns possam entender.
+6. Seja factual e neutro.
+7. IMPORTANTE: Escreva sempre em português."""
+
+# Allowed categories per side, each answered by a single letter (A, B, ...)
+_REVENUE_CATEGORIES = [
+    CategoryEnum.PERSONAL_TAXES,
+    CategoryEnum.CORPORATE_TAXES,
+    CategoryEnum.TAXES_ON_PURCHASES,
+    CategoryEnum.SOCIAL_SECURITY_CONTRIBUTIONS,
+    CategoryEnum.OTHER_REVENUE,
+]
+_EXPENSE_CATEGORIES = [
+    CategoryEnum.HEALTH,
+    CategoryEnum.EDUCATION,
+    CategoryEnum.PENSIONS_SOCIAL_SUPPORT,
+    CategoryEnum.RUNNING_GOVERNMENT,
+    CategoryEnum.SECURITY_DEFENSE,
+    CategoryEnum.JUSTICE,
+    CategoryEnum.INFRASTRUCTURE_ENVIRONMENT,
+    CategoryEnum.PUBLIC_DEBT,
+]
+_LETTER_TO_CAT_REVENUE = {chr(ord("A") + i): cat for i, cat in enumerate(_REVENUE_CATEGORIES)}
+_LETTER_TO_CAT_EXPENSE = {chr(ord("A") + i): cat for i, cat in enumerate(_EXPENSE_CATEGORIES)}
+
+# A bare letter answer, optionally followed by ")" / "." / ":" and the label
+_LETTER_ANSWER_RE = re.compile(r"^([A-Za-z])(?:[).:]|\s|$)")
+
+
+def _category_options(letter_to_cat: dict) -> str:
+    """Render the lettered category list used in the categorize prompts."""
+    return "\n".join(f"{letter}) {cat.value}" for letter, cat in letter_to_cat.items())
+
+
+_CATEGORIZE_SYSTEM_PROMPT_TEMPLATE = """
+Você é um categorizador de orçamento. Atribua cada item a exatamente uma categoria da lista permitida.
+
+Lado: {side_label}
+Categorias permitidas:
+{options}
+
+Responda APENAS com uma letra (a letra da categoria), nada mais.
+"""
+_CATEGORIZE_SYSTEM_PROMPT_REVENUE = _CATEGORIZE_SYSTEM_PROMPT_TEMPLATE.format(
+    side_label="RECEITA", options=_category_options(_LETTER_TO_CAT_REVENUE)
+)
+_CATEGORIZE_SYSTEM_PROMPT_EXPENSE = _CATEGORIZE_SYSTEM_PROMPT_TEMPLATE.format(
+    side_label="DESPESA", options=_category_options(_LETTER_TO_CAT_EXPENSE)
+)
+
+# Combined categorize + explain prompt (one round-trip per item)
+_CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_TEMPLATE = """Você é um analista de documentos orçamentais. Para cada item, atribua uma categoria e gere uma explicação.
+
+Lado: {side_label}
+Categorias permitidas:
+{options}
+
+REGRAS:
+1. Produza APENAS JSON válido com este esquema exato:
+{{"category": "letra da categoria", "explanation": "explicação"}}
+2. category deve ser apenas a letra de uma das categorias permitidas.
+3. explanation deve ter apenas 2-3 frases, baseadas APENAS na evidência e no contexto da secção.
+4. NÃO adicione opiniões políticas ou especulação.
+5. NÃO invente números além do que está na evidência.
+6. Use linguagem simples que cidadãos comuns possam entender. Seja factual e neutro.
+7. IMPORTANTE: Escreva sempre em português.
+"""
+_CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_REVENUE = _CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_TEMPLATE.format(
+    side_label="RECEITA", options=_category_options(_LETTER_TO_CAT_REVENUE)
+)
+_CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_EXPENSE = _CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_TEMPLATE.format(
+    side_label="DESPESA", options=_category_options(_LETTER_TO_CAT_EXPENSE)
+)
 
 class LLMClient:
     """Client for LLM operations - provider-agnostic interface."""
@@ -26,14 +221,19 @@ class LLMClient:
             self.provider = create_provider(
                 "openai",
                 api_key=settings.OPENAI_API_KEY,
-                model=settings.OPENAI_MODEL
+                model=settings.OPENAI_MODEL,
+                breaker_cooldown=settings.LLM_BREAKER_COOLDOWN
             )
         elif provider_type == "ollama":
             self.provider = create_provider(
                 "ollama",
                 base_url=settings.OLLAMA_BASE_URL,
                 model=settings.OLLAMA_MODEL,
-                use_chat_api=settings.OLLAMA_USE_CHAT_API
+                use_chat_api=settings.OLLAMA_USE_CHAT_API,
+                keep_alive=settings.OLLAMA_KEEP_ALIVE,
+                num_ctx=settings.OLLAMA_NUM_CTX,
+                breaker_cooldown=settings.LLM_BREAKER_COOLDOWN,
+                stream_max_time=settings.OLLAMA_STREAM_MAX_TIME
             )
         elif provider_type == "disabled":
             self.provider = create_provider("disabled")
@@ -41,6 +241,33 @@ class LLMClient:
             logger.warning(f"Unknown provider '{provider_type}', falling back to disabled")
             self.provider = create_provider("disabled")
         
+        # Bind the provider call once so the hot path skips repeated attribute lookups
+        self._call = self.provider.call
+        self._acall = self.provider.acall
+        self._stream = self.provider.stream_call
+        
+        # Dry-run mode: replace the LLM-backed methods with instant defaults,
+        # so the normal methods need no per-call "disabled" branch
+        if isinstance(self.provider, DisabledProvider):
+            self._install_disabled_methods()
+        
+        # Identical prompts already in flight are awaited, not sent again; the
+        # semaphore caps concurrent blocking calls (Celery worker threads)
+        self._flights = SingleFlight()
+        self._aflights = AsyncSingleFlight()
+        self._inflight = threading.BoundedSemaphore(settings.LLM_MAX_CONCURRENCY)
+        
+        # Response cache, keyed by provider + model + prompt hash
+        self._cache: Optional[LLMCache] = None
+        self._cache_ns = f"llm:{provider_type}:{getattr(self.provider, 'model', '')}:"
+        if settings.LLM_CACHE_ENABLED and not isinstance(self.provider, DisabledProvider):
+            self._cache = create_cache(
+                settings.LLM_CACHE_BACKEND,
+                url=settings.REDIS_URL,
+                path=settings.LLM_CACHE_PATH,
+                ttl=settings.LLM_CACHE_TTL,
+            )
+        
         # Log provider availability
         if hasattr(self.provider, 'is_available'):
             if self.provider.is_available():
@@ -48,6 +275,39 @@ class LLMClient:
             else:
                 logger.warning(f"LLM provider '{provider_type}' is not available")
     
+    def _install_disabled_methods(self) -> None:
+        """Shadow the LLM-backed public methods with ones returning the dry-run defaults."""
+        def categorize(side, title_path, description):
+            return self._default_category(side)
+        
+        def explain(title_path, evidence_text):
+            return self._default_explanation(title_path, evidence_text, 100)
+        
+        def categorize_and_explain(side, title_path, description, evidence_text):
+            return categorize(side, title_path, description), explain(title_path, evidence_text)
+        
+        def batch(fn):
+            def run(args_list):
+                return [fn(*args) for args in args_list]
+            return run
+        
+        def async_batch(fn):
+            async def run(args_list):
+                return [fn(*args) for args in args_list]
+            return run
+        
+        self.iter_extract_items = lambda title_path, pages_text: iter(())
+        self.extract_items_batched = lambda sections: [[] for _ in sections]
+        self.categorize_item = categorize
+        self.explain_item = explain
+        self.categorize_and_explain = categorize_and_explain
+        self.categorize_items = batch(categorize)
+        self.explain_items = batch(explain)
+        self.categorize_and_explain_items = batch(categorize_and_explain)
+        self.categorize_items_batch = async_batch(categorize)
+        self.explain_items_batch = async_batch(explain)
+        self.categorize_and_explain_items_batch = async_batch(categorize_and_explain)
+    
     def _call_with_retry(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
         """
         Call LLM provider with retries.
@@ -60,86 +320,94 @@ class LLMClient:
         Returns:
             Response text
         """
-        return self.provider.call(prompt, system_prompt, max_retries)
+        key = self._cache_key(prompt, system_prompt)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        def call() -> str:
+            with self._inflight:
+                response = self._call(prompt, system_prompt, max_retries)
+            self._cache_set(key, response)
+            return response
+        
+        return self._flights.do(key, call)
     
-    def extract_items(self, title_path: str, pages_text: str) -> List[ExtractedItem]:
+    async def _acall_with_retry(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
+        """Async counterpart of _call_with_retry (same response cache)."""
+        key = self._cache_key(prompt, system_prompt)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        async def call() -> str:
+            response = await self._acall(prompt, system_prompt, max_retries)
+            self._cache_set(key, response)
+            return response
+        
+        return await self._aflights.do(key, call)
+    
+    def _cache_key(self, prompt: str, system_prompt: str) -> str:
+        """Content-addressed key for a prompt pair (response cache and in-flight dedup)."""
+        return cache_key(self._cache_ns, prompt, system_prompt)
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Look up a cached response (None on miss or when caching is off)."""
+        if self._cache is None:
+            return None
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit for {key}")
+        return cached
+    
+    def _cache_set(self, key: str, response: str) -> None:
+        """Store a non-empty response."""
+        if self._cache is None or not response:
+            return
+        self._cache.set(key, response)
+    
+    def _slice_json(self, response_text: str, allow_array: bool = False) -> str:
+        """Strip markdown code fences and surrounding prose from a JSON answer."""
+        # Sometimes LLM wraps JSON in markdown code blocks
+        match = _FENCE_RE.match(response_text)
+        if match:
+            response_text = match.group(1)
+        
+        # Try to extract JSON if wrapped in other text
+        return _slice_first_json(response_text, allow_array)
+    
+    def _is_complete_json(self, response_text: str) -> bool:
+        """Whether an answer holds a complete JSON value (cut-off answers are not cached)."""
+        try:
+            orjson.loads(self._slice_json(response_text, allow_array=True))
+        except orjson.JSONDecodeError:
+            return False
+        return True
+    
+    def _parse_extract_response(self, title_path: str, response_text: str) -> List[ExtractedItem]:
         """
-        Extract budget items from text using LLM.
+        Parse a complete extraction response into items.
         
         Args:
-            title_path: Section breadcrumb path (e.g., "L1 > L2 > L3")
-            pages_text: Text from pages with markers like "--- PAGE 12 ---\n...text..."
+            title_path: Section breadcrumb path (for logging)
+            response_text: Raw LLM response text
             
         Returns:
-            List of extracted items
+            List of extracted items (empty on parse errors)
         """
-        system_prompt = """Você é um analisador de documentos orçamentais muito experiente. Extraia itens de linha orçamental do texto fornecido.
-        REGRAS CRÍTICAS:
-        1. Produza APENAS JSON válido correspondendo a este esquema exato:
-        {
-        "items": [
-            {
-            "side": "REVENUE" ou "EXPENSE",
-            "descriptionOriginal": "texto exato do documento",
-            "value": número ou null (NÃO invente números, use null se incerto),
-            "unit": "EUR" ou "THOUSAND_EUR" ou "MILLION_EUR" ou "UNKNOWN",
-            "pageNumber": número (a página onde evidenceText aparece),
-            "evidenceText": "excerto literal do texto de entrada (50-200 caracteres)"
-            }
-        ]
-        }
-
-        2. NÃO calcule totais nem invente números. Extraia apenas o que vê.
-        3. Se um valor não estiver claro ou faltar, defina value como null.
-        4. evidenceText deve ser um excerto literal da entrada (copie e cole, não parafraseie).
-        5. pageNumber deve corresponder ao marcador de página na entrada (ex: se a evidência está após "--- PAGE 12 ---", use 12).
-        6. side deve ser REVENUE ou EXPENSE com base no contexto.
-        7. Extraia TODOS os itens orçamentais que encontrar, mesmo que o valor seja null.
-        8. IMPORTANTE: Todas as descrições e textos devem estar em português.
-        """
-        
-        user_prompt = f"""Secção: {title_path}
-        {pages_text}
-        Extraia todos os itens de linha orçamental do texto acima. Retorne apenas JSON, sem outro texto."""
-                
         try:
-            response_text = self._call_with_retry(user_prompt, system_prompt)
-            
-            if settings.LLM_DISABLED or not response_text:
-                # Return empty list in dry-run mode or if provider returned empty
-                return []
-            
             # Parse JSON response
-            # Sometimes LLM wraps JSON in markdown code blocks
-            response_text = response_text.strip()
-            if response_text.startswith("```"):
-                # Remove markdown code block markers
-                lines = response_text.split('\n')
-                # Find the closing ```
-                closing_idx = -1
-                for i, line in enumerate(lines[1:], 1):
-                    if line.strip().startswith("```"):
-                        closing_idx = i
-                        break
-                if closing_idx > 0:
-                    response_text = '\n'.join(lines[1:closing_idx])
-                else:
-                    response_text = '\n'.join(lines[1:])
-            
-            # Try to extract JSON if wrapped in other text
-            # Look for JSON object boundaries
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}')
-            if start_idx >= 0 and end_idx > start_idx:
-                response_text = response_text[start_idx:end_idx + 1]
-            
-            data = json.loads(response_text)
-            extract_response = ExtractResponse(**data)
+            response_text = self._slice_json(response_text, allow_array=True)
+            data = orjson.loads(response_text)
+            if isinstance(data, list):
+                # Bare items array without the {"items": ...} wrapper
+                data = {"items": data}
+            extract_response = ExtractResponse.model_validate(data)
             
             logger.info(f"Extracted {len(extract_response.items)} items from section {title_path}")
             return extract_response.items
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"JSON decode error extracting items: {e}")
             logger.debug(f"Response text: {response_text[:500]}")
             # Return empty list on error (don't fail the whole job)
@@ -149,90 +417,322 @@ class LLMClient:
             # Return empty list on error (don't fail the whole job)
             return []
     
-    def categorize_item(self, side: SideEnum, title_path: str, description: str) -> CategoryEnum:
+    def iter_extract_items(self, title_path: str, pages_text: str) -> Iterator[ExtractedItem]:
         """
-        Categorize a budget item into the simple taxonomy.
+        Extract budget items from text using LLM, yielding each item as soon as it is complete.
+        
+        The response is streamed from the provider and parsed incrementally with
+        ijson, so validation overlaps with generation. Any prose or code fence
+        before the JSON object is skipped. If streaming parsing fails before any
+        item was produced, the buffered text goes through the regular parser.
+        Only an answer holding a complete JSON value is cached.
+        
+        The stream counts against LLM_MAX_CONCURRENCY until it ends, so do not
+        make other client calls from the same thread while iterating. Identical
+        concurrent streams are not coalesced.
         
         Args:
-            side: REVENUE or EXPENSE
-            title_path: Section breadcrumb path
-            description: Original description text
+            title_path: Section breadcrumb path (e.g., "L1 > L2 > L3")
+            pages_text: Text from pages with markers like "--- PAGE 12 ---\n...text..."
             
-        Returns:
-            Category enum value
+        Yields:
+            Extracted items
         """
-        if settings.LLM_DISABLED:
-            # Return a default category in dry-run mode
-            return CategoryEnum.OTHER_REVENUE if side == SideEnum.REVENUE else CategoryEnum.INFRASTRUCTURE_ENVIRONMENT
+        user_prompt = f"""Secção: {title_path}
+        {pages_text}
+        Extraia todos os itens de linha orçamental do texto acima. Retorne apenas JSON, sem outro texto."""
         
-        # Define allowed categories based on side (in Portuguese)
-        if side == SideEnum.REVENUE:
-            allowed = [
-                "Impostos sobre pessoas",
-                "Impostos sobre empresas",
-                "Impostos sobre compras",
-                "Contribuições para segurança social",
-                "Outras receitas"
-            ]
+        key = self._cache_key(user_prompt, _EXTRACT_SYSTEM_PROMPT)
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield from self._parse_extract_response(title_path, cached)
+            return
+        
+        chunks = []
+        parsed = ijson.sendable_list()
+        parser = None  # Created once the start of the JSON value is seen
+        started = False
+        item_count = 0
+        # The stream holds one LLM_MAX_CONCURRENCY slot until it ends or is closed
+        with self._inflight:
+            try:
+                for chunk in self._stream(user_prompt, _EXTRACT_SYSTEM_PROMPT):
+                    chunks.append(chunk)
+                    if not started:
+                        # Skip anything (fences, prose) before the JSON value
+                        buffered = "".join(chunks)
+                        start_idx = _find_json_start(buffered, allow_array=True)
+                        if start_idx < 0:
+                            continue
+                        started = True
+                        # Wrapped {"items": [...]} or a bare items array
+                        prefix = "items.item" if buffered[start_idx] == "{" else "item"
+                        parser = ijson.items_coro(parsed, prefix, use_float=True)
+                        chunk = buffered[start_idx:]
+                    if parser is None:
+                        # JSON value already closed; keep the rest for the cache only
+                        continue
+                    try:
+                        parser.send(chunk.encode("utf-8"))
+                    except ijson.JSONError:
+                        # Trailing text after the JSON object (e.g. a closing code fence)
+                        parser = None
+                    for obj in parsed:
+                        yield ExtractedItem.model_validate(obj)
+                        item_count += 1
+                    del parsed[:]
+                
+                if parser is not None:
+                    try:
+                        parser.close()
+                    except ijson.JSONError:
+                        # Truncated response; keep the items completed so far
+                        pass
+                    for obj in parsed:
+                        yield ExtractedItem.model_validate(obj)
+                        item_count += 1
+            except ProviderUnavailable:
+                # Provider outage: fail the job instead of storing fallback values
+                raise
+            except StreamTimeout as e:
+                # Cut off at the stream deadline: keep what was completed, never cache it
+                logger.warning(f"Extraction stream for section {title_path} cut off after {item_count} items: {e}")
+                if not item_count:
+                    yield from self._parse_extract_response(title_path, "".join(chunks))
+                return
+            except Exception as e:
+                if item_count:
+                    logger.error(f"Error streaming items from section {title_path} after {item_count} items: {e}")
+                    return
+                logger.warning(f"Streaming parse failed for section {title_path}, parsing buffered response: {e}")
+                yield from self._parse_extract_response(title_path, "".join(chunks))
+                return
+        
+        response_text = "".join(chunks)
+        if self._is_complete_json(response_text):
+            self._cache_set(key, response_text)
         else:
-            allowed = [
-                "Saúde",
-                "Educação",
-                "Pensões e apoio social",
-                "Funcionamento do governo",
-                "Segurança e defesa",
-                "Justiça",
-                "Infraestrutura e ambiente",
-                "Dívida pública"
-            ]
+            logger.warning(f"Extraction answer for section {title_path} is incomplete, not caching it")
+        if not item_count and response_text:
+            # Streaming parser found nothing; give the tolerant full-text parser a try
+            yield from self._parse_extract_response(title_path, response_text)
+            return
+        logger.info(f"Extracted {item_count} items from section {title_path}")
+    
+    def extract_items(self, title_path: str, pages_text: str) -> List[ExtractedItem]:
+        """
+        Extract budget items from text using LLM.
         
-        system_prompt = f"""
-        Você é um categorizador de orçamento. Atribua cada item a exatamente uma categoria da lista permitida.
-
-        Lado: {"RECEITA" if side == SideEnum.REVENUE else "DESPESA"}
-        Categorias permitidas: {', '.join(allowed)}
-
-        Retorne APENAS o nome exato da categoria da lista permitida, nada mais.
-        IMPORTANTE: Retorne o nome da categoria em português exatamente como aparece na lista.
+        Args:
+            title_path: Section breadcrumb path (e.g., "L1 > L2 > L3")
+            pages_text: Text from pages with markers like "--- PAGE 12 ---\n...text..."
+            
+        Returns:
+            List of extracted items
+        """
+        return list(self.iter_extract_items(title_path, pages_text))
+    
+    def _batch_section_items(self, count: int, entries: Iterable[dict]) -> Dict[int, List[ExtractedItem]]:
+        """Validated items of each section entry of a batched answer, by 0-based section index."""
+        results: Dict[int, List[ExtractedItem]] = {}
+        for position, entry in enumerate(entries):
+            # Sections are numbered from 1; fall back to the answer's order
+            index = int(entry.get("section") or position + 1) - 1
+            if 0 <= index < count:
+                results[index] = ExtractResponse.model_validate({"items": entry.get("items") or []}).items
+        return results
+    
+    def _parse_extract_batch_response(self, count: int, response_text: str) -> List[List[ExtractedItem]]:
+        """Parse a batched extraction response into one item list per section (raises on malformed JSON)."""
+        data = orjson.loads(self._slice_json(response_text, allow_array=True))
+        if isinstance(data, dict):
+            data = data["sections"]
+        # else: bare array of section entries, without the {"sections": ...} wrapper
+        
+        by_index = self._batch_section_items(count, data)
+        return [by_index.get(index, []) for index in range(count)]
+    
+    def _parse_partial_extract_batch_response(self, count: int, response_text: str) -> Dict[int, List[ExtractedItem]]:
         """
+        Section entries completed before a truncated batched answer broke off.
+        
+        Returns:
+            Items per 0-based section index, for the complete entries only
+        """
+        response_text = self._slice_json(response_text, allow_array=True)
+        prefix = "sections.item" if response_text.startswith("{") else "item"
+        entries = ijson.sendable_list()
+        parser = ijson.items_coro(entries, prefix, use_float=True)
+        try:
+            parser.send(response_text.encode("utf-8"))
+            parser.close()
+        except ijson.JSONError:
+            # Cut off mid-entry; the entries before it are complete
+            pass
+        return self._batch_section_items(count, entries)
+    
+    def extract_items_batched(self, sections: List[Tuple[str, str]]) -> List[List[ExtractedItem]]:
+        """
+        Extract budget items from several short sections with a single LLM call.
+        
+        The answer is streamed and may use NUM_PREDICT tokens per section, the
+        budget each section would get on its own. If it is still cut off (token
+        cap or OLLAMA_STREAM_MAX_TIME), the sections
+        completed before the cut are kept and only the rest are extracted one
+        by one. Only a completely parsed answer is cached.
+        
+        Args:
+            sections: List of (title_path, pages_text) tuples
+            
+        Returns:
+            Extracted items per section, in the same order as the input
+        """
+        if len(sections) == 1:
+            return [self.extract_items(*sections[0])]
+        
+        sections_text = "\n\n".join(
+            f"=== SECÇÃO {number}: {title_path} ===\n{pages_text}"
+            for number, (title_path, pages_text) in enumerate(sections, start=1)
+        )
+        user_prompt = f"""{sections_text}
+        Extraia todos os itens de linha orçamental de cada secção acima. Retorne apenas JSON, sem outro texto."""
+        
+        key = self._cache_key(user_prompt, _EXTRACT_BATCH_SYSTEM_PROMPT)
+        
+        def call() -> str:
+            # Streamed: a long answer arrives in chunks instead of running into the read timeout
+            chunks = []
+            with self._inflight:
+                try:
+                    for chunk in self._stream(
+                        user_prompt, _EXTRACT_BATCH_SYSTEM_PROMPT, num_predict=NUM_PREDICT * len(sections)
+                    ):
+                        chunks.append(chunk)
+                except StreamTimeout as e:
+                    # Partial answer: its completed sections are salvaged below, it is never cached
+                    logger.warning(f"Batched extraction stream for {len(sections)} sections cut off: {e}")
+            return "".join(chunks)
+        
+        try:
+            response_text = self._cache_get(key)
+            fresh = response_text is None
+            if fresh:
+                response_text = self._flights.do(key, call)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.warning(f"Batched extraction of {len(sections)} sections failed, extracting them one by one: {e}")
+            return [self.extract_items(title_path, pages_text) for title_path, pages_text in sections]
+        
+        try:
+            results = self._parse_extract_batch_response(len(sections), response_text)
+        except Exception as e:
+            try:
+                completed = self._parse_partial_extract_batch_response(len(sections), response_text)
+            except Exception:
+                completed = {}
+            logger.warning(
+                f"Batched extraction answer for {len(sections)} sections is incomplete ({e}), "
+                f"extracting {len(sections) - len(completed)} of them one by one"
+            )
+            return [
+                completed[index] if index in completed else self.extract_items(title_path, pages_text)
+                for index, (title_path, pages_text) in enumerate(sections)
+            ]
+        
+        if fresh:
+            self._cache_set(key, response_text)
+        logger.info(f"Extracted {sum(len(items) for items in results)} items from {len(sections)} sections in one call")
+        return results
+    
+    def _default_category(self, side: SideEnum) -> CategoryEnum:
+        """Fallback category used when the LLM is disabled or its answer can't be mapped."""
+        if side == SideEnum.REVENUE:
+            return CategoryEnum.OTHER_REVENUE
+        else:
+            return CategoryEnum.INFRASTRUCTURE_ENVIRONMENT
+    
+    def _categorize_prompts(self, side: SideEnum, title_path: str, description: str) -> Tuple[str, str]:
+        """Build the (system_prompt, user_prompt) pair for categorizing an item."""
+        if side == SideEnum.REVENUE:
+            system_prompt = _CATEGORIZE_SYSTEM_PROMPT_REVENUE
+        else:
+            system_prompt = _CATEGORIZE_SYSTEM_PROMPT_EXPENSE
                 
         user_prompt = f"""
         Secção: {title_path}
         Descrição: {description}
 
-        Categorize este item orçamental. Retorne apenas o nome da categoria que mais se relaciona em português.
+        Categorize este item orçamental. Retorne apenas a letra da categoria que mais se relaciona.
         """
+        return system_prompt, user_prompt
+    
+    def _parse_category(self, side: SideEnum, response_text: str) -> CategoryEnum:
+        """Map a raw LLM category answer (a letter, or a label as fallback) to a CategoryEnum value."""
+        response_clean = response_text.strip()
+        
+        # Expected answer: the category letter for this side
+        match = _LETTER_ANSWER_RE.match(response_clean)
+        if match:
+            letter_to_cat = _LETTER_TO_CAT_REVENUE if side == SideEnum.REVENUE else _LETTER_TO_CAT_EXPENSE
+            cat = letter_to_cat.get(match.group(1).upper())
+            if cat is not None:
+                logger.info(f"Categorized item as {cat.value}")
+                return cat
+        
+        # Model answered with a label instead - try exact match first
+        cat = _CATEGORY_BY_VALUE.get(response_clean)
+        if cat is not None:
+            logger.info(f"Categorized item as {cat.value}")
+            return cat
+        
+        # If no exact match, try case-insensitive
+        cat = _CATEGORY_BY_VALUE_LOWER.get(response_clean.lower())
+        if cat is not None:
+            logger.info(f"Categorized item as {cat.value} (case-insensitive match)")
+            return cat
+        
+        # Default fallback
+        logger.warning(f"Could not match category '{response_text}', using default")
+        return self._default_category(side)
+    
+    def categorize_item(self, side: SideEnum, title_path: str, description: str) -> CategoryEnum:
+        """
+        Categorize a budget item into the simple taxonomy.
+        
+        Args:
+            side: REVENUE or EXPENSE
+            title_path: Section breadcrumb path
+            description: Original description text
+            
+        Returns:
+            Category enum value
+        """
+        system_prompt, user_prompt = self._categorize_prompts(side, title_path, description)
                 
         try:
             response_text = self._call_with_retry(user_prompt, system_prompt).strip()
-            
-            # Map response to enum - try exact match first
-            response_clean = response_text.strip()
-            for cat in CategoryEnum:
-                if cat.value == response_clean:
-                    logger.info(f"Categorized item as {cat.value}")
-                    return cat
-            
-            # If no exact match, try case-insensitive
-            for cat in CategoryEnum:
-                if cat.value.lower() == response_clean.lower():
-                    logger.info(f"Categorized item as {cat.value} (case-insensitive match)")
-                    return cat
-            
-            # Default fallback
-            logger.warning(f"Could not match category '{response_text}', using default")
-            if side == SideEnum.REVENUE:
-                return CategoryEnum.OTHER_REVENUE
-            else:
-                return CategoryEnum.INFRASTRUCTURE_ENVIRONMENT
-                
+            return self._parse_category(side, response_text)
+        except ProviderUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error categorizing item: {e}")
             # Return default category on error
-            if side == SideEnum.REVENUE:
-                return CategoryEnum.OTHER_REVENUE
-            else:
-                return CategoryEnum.INFRASTRUCTURE_ENVIRONMENT
+            return self._default_category(side)
+    
+    def _default_explanation(self, title_path: str, evidence_text: str, max_chars: int = 200) -> str:
+        """Fallback explanation used when the LLM is disabled or fails."""
+        return f"This item appears in section {title_path}. Evidence: {evidence_text[:max_chars]}..."
+    
+    def _explain_prompts(self, title_path: str, evidence_text: str) -> Tuple[str, str]:
+        """Build the (system_prompt, user_prompt) pair for explaining an item."""
+        system_prompt = _EXPLAIN_SYSTEM_PROMPT
+                
+        user_prompt = f"""Secção: {title_path}
+        Evidência: {evidence_text}
+
+        Explique este item orçamental em 2-3 frases para cidadãos comuns. Escreva em português."""
+        return system_prompt, user_prompt
     
     def explain_item(self, title_path: str, evidence_text: str) -> str:
         """
@@ -245,34 +745,205 @@ class LLMClient:
         Returns:
             Explanation text (2-3 sentences)
         """
-        if settings.LLM_DISABLED:
-            return f"This item appears in section {title_path}. Evidence: {evidence_text[:100]}..."
-        
-        system_prompt = """Você é um explicador de documentos orçamentais. Gere explicações claras e factuais para itens orçamentais.
-
-        REGRAS:
-        1. Escreva apenas 2-3 frases.
-        2. Baseie a explicação APENAS no texto de evidência e no contexto da secção.
-        3. NÃO adicione opiniões políticas ou especulação.
-        4. NÃO invente números além do que está na evidência.
-        5. Use linguagem simples que cidadãos comuns possam entender.
-        6. Seja factual e neutro.
-        7. IMPORTANTE: Escreva sempre em português."""
+        system_prompt, user_prompt = self._explain_prompts(title_path, evidence_text)
+                
+        try:
+            explanation = self._call_with_retry(user_prompt, system_prompt).strip()
+            logger.info(f"Generated explanation (length: {len(explanation)})")
+            return explanation
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating explanation: {e}")
+            return self._default_explanation(title_path, evidence_text)
+    
+    def _categorize_and_explain_prompts(
+        self, side: SideEnum, title_path: str, description: str, evidence_text: str
+    ) -> Tuple[str, str]:
+        """Build the (system_prompt, user_prompt) pair for the combined call."""
+        if side == SideEnum.REVENUE:
+            system_prompt = _CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_REVENUE
+        else:
+            system_prompt = _CATEGORIZE_EXPLAIN_SYSTEM_PROMPT_EXPENSE
                 
         user_prompt = f"""Secção: {title_path}
+        Descrição: {description}
         Evidência: {evidence_text}
 
-        Explique este item orçamental em 2-3 frases para cidadãos comuns. Escreva em português."""
-                
+        Categorize e explique este item orçamental. Retorne apenas JSON, sem outro texto."""
+        return system_prompt, user_prompt
+    
+    def _parse_categorize_and_explain(
+        self, side: SideEnum, title_path: str, evidence_text: str, response_text: str
+    ) -> Tuple[CategoryEnum, str]:
+        """Parse the combined JSON answer, falling back per field when missing."""
+        data = orjson.loads(self._slice_json(response_text))
+        category = self._parse_category(side, str(data.get("category") or ""))
+        explanation = str(data.get("explanation") or "").strip()
+        if explanation:
+            logger.info(f"Generated explanation (length: {len(explanation)})")
+        else:
+            logger.warning("Combined response had no explanation, using default")
+            explanation = self._default_explanation(title_path, evidence_text)
+        return category, explanation
+    
+    def categorize_and_explain(
+        self, side: SideEnum, title_path: str, description: str, evidence_text: str
+    ) -> Tuple[CategoryEnum, str]:
+        """
+        Categorize and explain a budget item in a single LLM call.
+        
+        Args:
+            side: REVENUE or EXPENSE
+            title_path: Section breadcrumb path
+            description: Original description text
+            evidence_text: Literal excerpt from document
+            
+        Returns:
+            Tuple of (category, explanation)
+        """
+        system_prompt, user_prompt = self._categorize_and_explain_prompts(
+            side, title_path, description, evidence_text
+        )
+        
         try:
-            explanation = self._call_with_retry(user_prompt, system_prompt).strip()
+            response_text = self._call_with_retry(user_prompt, system_prompt)
+            return self._parse_categorize_and_explain(side, title_path, evidence_text, response_text)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error categorizing and explaining item: {e}")
+            return self._default_category(side), self._default_explanation(title_path, evidence_text)
+    
+    async def _gather_bounded(self, coros: List[Awaitable]) -> list:
+        """
+        Run coroutines concurrently, capped at LLM_MAX_CONCURRENCY in-flight calls.
+        
+        The provider's async connection pool lives for the duration of the batch
+        and is closed afterwards, since it is bound to this event loop.
+        """
+        semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        
+        async def bounded(coro: Awaitable):
+            async with semaphore:
+                return await coro
+        
+        try:
+            return await asyncio.gather(*(bounded(c) for c in coros))
+        finally:
+            await self.provider.aclose()
+    
+    async def _gather_unique(self, fn: Callable[..., Awaitable], args_list: List[Tuple[Hashable, ...]]) -> list:
+        """
+        Run fn once per distinct argument tuple and fan the results out in input order.
+        
+        Budget documents repeat the same line (e.g. "Pessoal e Encargos Sociais")
+        many times within a section; duplicates neither take a concurrency slot
+        nor look up the response cache again.
+        """
+        unique = list(dict.fromkeys(args_list))
+        results = dict(zip(unique, await self._gather_bounded([fn(*args) for args in unique])))
+        return [results[args] for args in args_list]
+    
+    async def _acategorize_item(self, side: SideEnum, title_path: str, description: str) -> CategoryEnum:
+        """Async counterpart of categorize_item (same prompts, parsing and fallbacks)."""
+        system_prompt, user_prompt = self._categorize_prompts(side, title_path, description)
+        try:
+            response_text = (await self._acall_with_retry(user_prompt, system_prompt)).strip()
+            return self._parse_category(side, response_text)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error categorizing item: {e}")
+            return self._default_category(side)
+    
+    async def _aexplain_item(self, title_path: str, evidence_text: str) -> str:
+        """Async counterpart of explain_item (same prompts and fallbacks)."""
+        system_prompt, user_prompt = self._explain_prompts(title_path, evidence_text)
+        try:
+            explanation = (await self._acall_with_retry(user_prompt, system_prompt)).strip()
             logger.info(f"Generated explanation (length: {len(explanation)})")
             return explanation
+        except ProviderUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error generating explanation: {e}")
-            return f"This item appears in section {title_path}. Evidence: {evidence_text[:200]}..."
+            return self._default_explanation(title_path, evidence_text)
+    
+    async def _acategorize_and_explain(
+        self, side: SideEnum, title_path: str, description: str, evidence_text: str
+    ) -> Tuple[CategoryEnum, str]:
+        """Async counterpart of categorize_and_explain (same prompts, parsing and fallbacks)."""
+        system_prompt, user_prompt = self._categorize_and_explain_prompts(
+            side, title_path, description, evidence_text
+        )
+        try:
+            response_text = await self._acall_with_retry(user_prompt, system_prompt)
+            return self._parse_categorize_and_explain(side, title_path, evidence_text, response_text)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error categorizing and explaining item: {e}")
+            return self._default_category(side), self._default_explanation(title_path, evidence_text)
+    
+    async def categorize_items_batch(self, triples: List[Tuple[SideEnum, str, str]]) -> List[CategoryEnum]:
+        """
+        Categorize many budget items concurrently.
+        
+        Args:
+            triples: List of (side, title_path, description) tuples
+            
+        Returns:
+            Category enum values, in the same order as the input
+        """
+        return await self._gather_unique(self._acategorize_item, triples)
+    
+    async def explain_items_batch(self, pairs: List[Tuple[str, str]]) -> List[str]:
+        """
+        Generate explanations for many budget items concurrently.
+        
+        Args:
+            pairs: List of (title_path, evidence_text) tuples
+            
+        Returns:
+            Explanation texts, in the same order as the input
+        """
+        return await self._gather_unique(self._aexplain_item, pairs)
+    
+    async def categorize_and_explain_items_batch(
+        self, items: List[Tuple[SideEnum, str, str, str]]
+    ) -> List[Tuple[CategoryEnum, str]]:
+        """
+        Categorize and explain many budget items concurrently (one LLM call per distinct item).
+        
+        Args:
+            items: List of (side, title_path, description, evidence_text) tuples
+            
+        Returns:
+            (category, explanation) tuples, in the same order as the input
+        """
+        return await self._gather_unique(self._acategorize_and_explain, items)
+    
+    def categorize_items(self, triples: List[Tuple[SideEnum, str, str]]) -> List[CategoryEnum]:
+        """Synchronous wrapper around categorize_items_batch (for Celery tasks)."""
+        if not triples:
+            return []
+        return asyncio.run(self.categorize_items_batch(triples))
+    
+    def explain_items(self, pairs: List[Tuple[str, str]]) -> List[str]:
+        """Synchronous wrapper around explain_items_batch (for Celery tasks)."""
+        if not pairs:
+            return []
+        return asyncio.run(self.explain_items_batch(pairs))
+    
+    def categorize_and_explain_items(
+        self, items: List[Tuple[SideEnum, str, str, str]]
+    ) -> List[Tuple[CategoryEnum, str]]:
+        """Synchronous wrapper around categorize_and_explain_items_batch (for Celery tasks)."""
+        if not items:
+            return []
+        return asyncio.run(self.categorize_and_explain_items_batch(items))
 
 
 # Global client instance
 llm_client = LLMClient()
-
@@ -1,14 +1,169 @@
 """LLM provider implementations - abstract interface for different LLM backends."""
-import json
+import asyncio
+import atexit
+import random
+import threading
 import time
-import requests
+import httpx
+import orjson
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from collections import deque
+from hashlib import blake2b
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple, TypeVar
 from loguru import logger
 
 from app.schemas import ExtractResponse, ExtractedItem
 from app.models import SideEnum, CategoryEnum
 
+# Connection pool limits for the persistent per-provider HTTP clients
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+# How long an availability check result is reused (seconds)
+AVAILABILITY_TTL = 30.0
+
+# Request headers for pre-serialized JSON bodies
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Cap on generated tokens per call (answers are short JSON, a letter or 2-3 sentences)
+NUM_PREDICT = 512
+
+
+# Retry backoff: 1s, 2s, 4s, 4s, ... plus up to RETRY_JITTER seconds of random jitter,
+# so concurrent workers do not retry against a recovering backend in lockstep
+RETRY_BACKOFF_CAP = 4.0
+RETRY_JITTER = 0.5
+
+T = TypeVar("T")
+
+
+class ProviderUnavailable(Exception):
+    """Raised without calling the backend while the provider's circuit breaker is open."""
+    pass
+
+
+class StreamTimeout(TimeoutError):
+    """Raised when a streamed answer is cut off at the provider's stream deadline."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker over a rolling window of call outcomes.
+    
+    Opens when at least `failure_rate` of the last `window` calls failed (once
+    `min_calls` outcomes are known) and then rejects calls for `cooldown`
+    seconds. After the cooldown calls go through again; the first failure
+    reopens it, the first success closes it.
+    """
+    
+    def __init__(self, cooldown: float, window: int = 10, min_calls: int = 5, failure_rate: float = 0.5):
+        self.cooldown = cooldown
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self._outcomes = deque(maxlen=window)  # True = success
+        self._opened_at: Optional[float] = None
+        self._half_open = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Whether a call may be attempted now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            # Cooldown over: probe the backend again
+            self._opened_at = None
+            self._half_open = True
+            return True
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._outcomes.append(True)
+            self._half_open = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            tripped = self._half_open or (
+                len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate
+            )
+            if tripped and self._opened_at is None:
+                logger.warning(f"LLM circuit breaker open for {self.cooldown}s ({failures}/{len(self._outcomes)} recent calls failed)")
+                self._opened_at = time.monotonic()
+                self._half_open = False
+                self._outcomes.clear()
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Seconds to wait after a failed attempt (0-based): capped exponential plus jitter."""
+    return min(RETRY_BACKOFF_CAP, 2 ** attempt) + random.uniform(0, RETRY_JITTER)
+
+
+def _retry(fn: Callable[[], T], breaker: CircuitBreaker, max_retries: int, label: str) -> T:
+    """
+    Run fn, retrying failures with jittered backoff.
+    
+    Args:
+        fn: Zero-argument function performing one attempt
+        breaker: The provider's circuit breaker (every attempt is recorded)
+        max_retries: Maximum number of attempts
+        label: Name of the call, for log messages
+        
+    Returns:
+        The result of the first successful attempt
+        
+    Raises:
+        ProviderUnavailable: If the circuit breaker is open
+    """
+    for attempt in range(max_retries):
+        if not breaker.allow():
+            raise ProviderUnavailable(f"{label} skipped: provider marked unavailable after repeated failures")
+        try:
+            result = fn()
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning(f"{label} attempt {attempt + 1} failed: {e}")
+            if attempt < max_retries - 1:
+                time.sleep(_backoff_delay(attempt))
+            else:
+                raise
+        else:
+            breaker.record_success()
+            return result
+
+
+async def _aretry(fn: Callable[[], Awaitable[T]], breaker: CircuitBreaker, max_retries: int, label: str) -> T:
+    """Async counterpart of _retry()."""
+    for attempt in range(max_retries):
+        if not breaker.allow():
+            raise ProviderUnavailable(f"{label} skipped: provider marked unavailable after repeated failures")
+        try:
+            result = await fn()
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning(f"{label} attempt {attempt + 1} failed: {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(_backoff_delay(attempt))
+            else:
+                raise
+        else:
+            breaker.record_success()
+            return result
+
+
+def _new_http_client(timeout: float) -> httpx.Client:
+    """Create a persistent keep-alive HTTP client (HTTP/2 where the server supports it)."""
+    client = httpx.Client(
+        http2=True,
+        limits=HTTP_LIMITS,
+        timeout=httpx.Timeout(timeout, connect=5.0),
+    )
+    atexit.register(client.close)
+    return client
+
 
 class LLMProvider(ABC):
     """Abstract base class for LLM providers."""
@@ -28,6 +183,36 @@ class LLMProvider(ABC):
         """
         pass
     
+    def stream_call(
+        self, prompt: str, system_prompt: str, max_retries: int = 3, num_predict: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Call the LLM and yield the response text in chunks as it is generated.
+        
+        Providers without native streaming yield the full response as one chunk.
+        Retries only cover establishing the request, not a stream cut mid-way.
+        num_predict raises the cap on generated tokens for this call above
+        NUM_PREDICT (providers without a cap ignore it).
+        """
+        yield self.call(prompt, system_prompt, max_retries)
+    
+    async def acall(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
+        """
+        Async variant of call(), used by the batch pipeline.
+        
+        Providers without a native async client fall back to running the
+        blocking call in a worker thread.
+        """
+        return await asyncio.to_thread(self.call, prompt, system_prompt, max_retries)
+    
+    async def aclose(self) -> None:
+        """Release async resources (connection pools) opened by acall()."""
+        pass
+    
+    def close(self) -> None:
+        """Release the persistent HTTP connection pool, if any."""
+        pass
+    
     @abstractmethod
     def is_available(self) -> bool:
         """Check if the provider is available and configured."""
@@ -37,130 +222,297 @@ class LLMProvider(ABC):
 class OpenAIProvider(LLMProvider):
     """OpenAI API provider (for full LLMs like GPT-4)."""
     
-    def __init__(self, api_key: Optional[str], model: str):
+    def __init__(self, api_key: Optional[str], model: str, breaker_cooldown: float = 30.0):
         self.api_key = api_key
         self.model = model
         self.client = None
+        self.async_client = None
+        self._http: Optional[httpx.Client] = None
+        self._breaker = CircuitBreaker(cooldown=breaker_cooldown)
         if api_key:
             try:
                 from openai import OpenAI
-                self.client = OpenAI(api_key=api_key)
+                # Reuse TLS connections (and HTTP/2 multiplexing) across calls
+                self._http = _new_http_client(timeout=60.0)
+                self.client = OpenAI(api_key=api_key, http_client=self._http)
             except ImportError:
                 logger.warning("OpenAI package not installed. Install with: pip install openai")
     
     def is_available(self) -> bool:
         return self.client is not None
     
+    def _cache_routing(self, system_prompt: str) -> dict:
+        """
+        Request fields routing calls that share a system prompt to the same
+        prompt-prefix cache (the prefix must be byte-identical to hit it).
+        """
+        return {"prompt_cache_key": blake2b(system_prompt.encode("utf-8"), digest_size=8).hexdigest()}
+    
     def call(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
         """Call OpenAI API with retries and timeout."""
         if not self.client:
             raise ValueError("OpenAI client not initialized. Check OPENAI_API_KEY.")
         
-        for attempt in range(max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.0,  # Deterministic
-                    timeout=6.0,
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.warning(f"OpenAI call attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    raise
+        def attempt() -> str:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0,  # Deterministic
+                timeout=6.0,
+                extra_body=self._cache_routing(system_prompt),
+            )
+            return response.choices[0].message.content
+        
+        return _retry(attempt, self._breaker, max_retries, "OpenAI call")
+    
+    def stream_call(
+        self, prompt: str, system_prompt: str, max_retries: int = 3, num_predict: Optional[int] = None
+    ) -> Iterator[str]:
+        """Call OpenAI API with streaming, yielding content deltas (answers are not capped, num_predict is ignored)."""
+        if not self.client:
+            raise ValueError("OpenAI client not initialized. Check OPENAI_API_KEY.")
+        
+        def attempt():
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0,  # Deterministic
+                timeout=6.0,
+                extra_body=self._cache_routing(system_prompt),
+                stream=True,
+            )
+        
+        stream = _retry(attempt, self._breaker, max_retries, "OpenAI stream")
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def acall(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
+        """Call OpenAI API asynchronously with retries and timeout."""
+        if not self.client:
+            raise ValueError("OpenAI client not initialized. Check OPENAI_API_KEY.")
+        
+        if self.async_client is None:
+            from openai import AsyncOpenAI
+            self.async_client = AsyncOpenAI(api_key=self.api_key)
+        
+        async def attempt() -> str:
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0,  # Deterministic
+                timeout=6.0,
+                extra_body=self._cache_routing(system_prompt),
+            )
+            return response.choices[0].message.content
+        
+        return await _aretry(attempt, self._breaker, max_retries, "OpenAI async call")
+    
+    async def aclose(self) -> None:
+        """Close the async OpenAI client (bound to the current event loop)."""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+    
+    def close(self) -> None:
+        """Close the persistent HTTP connection pool."""
+        if self._http is not None:
+            self._http.close()
 
 
 class OllamaProvider(LLMProvider):
     """Ollama provider (for local SLMs like Qwen2.5, Llama, Mistral, etc.)."""
     
-    def __init__(self, base_url: str, model: str, use_chat_api: bool = None):
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        use_chat_api: bool = None,
+        keep_alive: str = "10m",
+        num_ctx: Optional[int] = None,
+        breaker_cooldown: float = 30.0,
+        stream_max_time: Optional[float] = None,
+    ):
         self.base_url = base_url.rstrip('/')
         self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.stream_max_time = stream_max_time
         # Auto-detect if model is instruction-tuned (contains 'instruct' or 'chat')
         # Instruction models work better with chat API
         if use_chat_api is None:
             self.use_chat_api = 'instruct' in model.lower() or 'chat' in model.lower()
         else:
             self.use_chat_api = use_chat_api
+        self._http = _new_http_client(timeout=10.0)  # Longer timeout for local models
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._breaker = CircuitBreaker(cooldown=breaker_cooldown)
+        self._url, self._template = self._request_template()
         self._check_availability()
     
     def _check_availability(self):
         """Check if Ollama is available."""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=1)
-            if response.status_code == 200:
+            response = self._http.get(f"{self.base_url}/api/tags", timeout=1)
+            available = response.status_code == 200
+            if available:
                 logger.info(f"Ollama available at {self.base_url}, using {'chat' if self.use_chat_api else 'generate'} API")
             else:
                 logger.warning(f"Ollama returned status {response.status_code}")
         except Exception as e:
+            available = False
             logger.warning(f"Could not connect to Ollama at {self.base_url}: {e}")
+        self._availability_cache = (time.monotonic(), available)
     
     def is_available(self) -> bool:
-        """Check if Ollama is available."""
+        """Check if Ollama is available (result cached for AVAILABILITY_TTL seconds)."""
+        checked_at, available = self._availability_cache
+        if time.monotonic() - checked_at < AVAILABILITY_TTL:
+            return available
         
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=1)
-            return response.status_code == 200
+            response = self._http.get(f"{self.base_url}/api/tags", timeout=1)
+            available = response.status_code == 200
         except Exception:
-            return False
+            available = False
+        self._availability_cache = (time.monotonic(), available)
+        return available
+    
+    def _request_template(self) -> Tuple[str, dict]:
+        """Build the endpoint URL and the static part of the request body, once."""
+        options = {
+            "temperature": 0.0,  # Deterministic
+            "num_predict": NUM_PREDICT,
+        }
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        
+        # keep_alive keeps the model loaded, so the KV cache of the (byte-stable)
+        # system prompt at the start of every request is reused across calls
+        template = {
+            "model": self.model,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": options,
+        }
+        if self.use_chat_api:
+            # Use chat API for instruction-tuned models (better for structured outputs)
+            return f"{self.base_url}/api/chat", template
+        # Use generate API for base/completion models
+        return f"{self.base_url}/api/generate", template
+    
+    def _build_body(
+        self, prompt: str, system_prompt: str, stream: bool = False, num_predict: Optional[int] = None
+    ) -> bytes:
+        """Serialize the request body: the shared template plus this call's prompt (and token cap)."""
+        if self.use_chat_api:
+            variable = {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ]
+            }
+        else:
+            variable = {"prompt": f"{system_prompt}\n\n{prompt}"}
+        if stream:
+            variable["stream"] = True
+        if num_predict:
+            variable["options"] = {**self._template["options"], "num_predict": num_predict}
+        return orjson.dumps({**self._template, **variable})
+    
+    def _parse_response(self, result: dict) -> str:
+        """Extract the generated text from a chat or generate response body."""
+        if self.use_chat_api:
+            # Chat API returns message content
+            return result.get("message", {}).get("content", "")
+        return result.get("response", "")
     
     def call(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
         """Call Ollama API with retries. Uses chat API for instruction models, generate API for others."""
-        for attempt in range(max_retries):
+        body = self._build_body(prompt, system_prompt)
+        
+        def attempt() -> str:
+            response = self._http.post(self._url, content=body, headers=JSON_HEADERS)
+            response.raise_for_status()
+            return self._parse_response(orjson.loads(response.content))
+        
+        return _retry(attempt, self._breaker, max_retries, "Ollama call")
+    
+    def stream_call(
+        self, prompt: str, system_prompt: str, max_retries: int = 3, num_predict: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Call Ollama API with streaming, yielding text chunks from the NDJSON response.
+        
+        The connection is closed when the consumer stops iterating or when the
+        stream runs past stream_max_time (raising StreamTimeout, so the partial
+        answer is not mistaken for a complete one); Ollama then stops
+        generating, which frees the model for the next request.
+        """
+        body = self._build_body(prompt, system_prompt, stream=True, num_predict=num_predict)
+        
+        def attempt() -> httpx.Response:
+            request = self._http.build_request("POST", self._url, content=body, headers=JSON_HEADERS)
+            response = self._http.send(request, stream=True)
             try:
-                if self.use_chat_api:
-                    # Use chat API for instruction-tuned models (better for structured outputs)
-                    response = requests.post(
-                        f"{self.base_url}/api/chat",
-                        json={
-                            "model": self.model,
-                            "messages": [
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": prompt}
-                            ],
-                            "stream": False,
-                            "keep_alive": 0,
-                            "options": {
-                                "temperature": 0.0,  # Deterministic
-                                "num_predict": 512,
-                            }
-                        },
-                        timeout=10.0,  # Longer timeout for local models
-                    )
-                    response.raise_for_status()
-                    result = response.json()
-                    # Chat API returns message content
-                    return result.get("message", {}).get("content", "")
-                else:
-                    # Use generate API for base/completion models
-                    full_prompt = f"{system_prompt}\n\n{prompt}"
-                    response = requests.post(
-                        f"{self.base_url}/api/generate",
-                        json={
-                            "model": self.model,
-                            "prompt": full_prompt,
-                            "stream": False,
-                            "options": {
-                                "temperature": 0.0,  # Deterministic
-                            }
-                        },
-                        timeout=10.0,  # Longer timeout for local models
-                    )
-                    response.raise_for_status()
-                    result = response.json()
-                    return result.get("response", "")
-            except Exception as e:
-                logger.warning(f"Ollama call attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                else:
-                    raise
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+            return response
+        
+        response = _retry(attempt, self._breaker, max_retries, "Ollama stream")
+        deadline = time.monotonic() + self.stream_max_time if self.stream_max_time else None
+        try:
+            for line in response.iter_lines():
+                if deadline is not None and time.monotonic() > deadline:
+                    raise StreamTimeout(f"Ollama stream exceeded {self.stream_max_time}s")
+                if not line:
+                    continue
+                result = orjson.loads(line)
+                chunk = self._parse_response(result)
+                if chunk:
+                    yield chunk
+                if result.get("done"):
+                    break
+        finally:
+            response.close()
+    
+    async def acall(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
+        """Call Ollama API asynchronously, reusing one connection pool per batch."""
+        if self._async_http is None:
+            self._async_http = httpx.AsyncClient(
+                limits=HTTP_LIMITS,
+                timeout=httpx.Timeout(10.0, connect=5.0),  # Longer timeout for local models
+            )
+        
+        body = self._build_body(prompt, system_prompt)
+        
+        async def attempt() -> str:
+            response = await self._async_http.post(self._url, content=body, headers=JSON_HEADERS)
+            response.raise_for_status()
+            return self._parse_response(orjson.loads(response.content))
+        
+        return await _aretry(attempt, self._breaker, max_retries, "Ollama async call")
+    
+    async def aclose(self) -> None:
+        """Close the async connection pool (bound to the current event loop)."""
+        if self._async_http is not None:
+            await self._async_http.aclose()
+            self._async_http = None
+    
+    def close(self) -> None:
+        """Close the persistent HTTP connection pool."""
+        self._http.close()
 
 
 class DisabledProvider(LLMProvider):
@@ -173,6 +525,10 @@ class DisabledProvider(LLMProvider):
         """Return empty string when LLM is disabled."""
         logger.info("LLM_DISABLED: skipping LLM call")
         return ""
+    
+    async def acall(self, prompt: str, system_prompt: str, max_retries: int = 3) -> str:
+        """Return empty string when LLM is disabled."""
+        return self.call(prompt, system_prompt, max_retries)
 
 
 def create_provider(provider_type: str, **kwargs) -> LLMProvider:
@@ -191,13 +547,18 @@ def create_provider(provider_type: str, **kwargs) -> LLMProvider:
     if provider_type == "openai":
         return OpenAIProvider(
             api_key=kwargs.get("api_key"),
-            model=kwargs.get("model", "gpt-4-turbo-preview")
+            model=kwargs.get("model", "gpt-4-turbo-preview"),
+            breaker_cooldown=kwargs.get("breaker_cooldown", 30.0)
         )
     elif provider_type == "ollama":
         return OllamaProvider(
             base_url=kwargs.get("base_url", "http://localhost:11434"),
             model=kwargs.get("model", "qwen2.5:3b-instruct"),
-            use_chat_api=kwargs.get("use_chat_api")
+            use_chat_api=kwargs.get("use_chat_api"),
+            keep_alive=kwargs.get("keep_alive", "10m"),
+            num_ctx=kwargs.get("num_ctx"),
+            breaker_cooldown=kwargs.get("breaker_cooldown", 30.0),
+            stream_max_time=kwargs.get("stream_max_time")
         )
     elif provider_type == "disabled":
         return DisabledProvider()
@@ -0,0 +1,80 @@
+"""Single-flight call coalescing - concurrent callers with the same key share one call."""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls from multiple threads."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+    
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Run fn, unless a call with the same key is already in flight.
+        
+        Args:
+            key: Identity of the call
+            fn: Zero-argument function performing the call
+            
+        Returns:
+            The result of fn (the in-flight call's result for late callers;
+            its exception is re-raised to them as well)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Coalesce concurrent calls from coroutines on one event loop."""
+    
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of SingleFlight.do()."""
+        future = self._calls.get(key)
+        if future is not None:
+            # Shielded: a cancelled follower must not cancel the shared call
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when no follower is waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -1,24 +1,28 @@
 """FastAPI application."""
+import asyncio
+import hashlib
 import os
 import uuid
-import shutil
 from pathlib import Path
-from typing import List
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Query
+from typing import List, Tuple
+from urllib.parse import quote
+import aiofiles
+from fastapi import BackgroundTasks, FastAPI, UploadFile, File, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
+from sqlalchemy import and_, select
 from loguru import logger
-from app.database import get_db, Base, engine
+from app.database import get_db, get_readonly_db, Base, engine
 from app.models import (
     Document, BudgetItem, ImportJob, Page,
-    SideEnum, CategoryEnum, ImportJobStatusEnum
+    CategoryEnum, ImportJobStatusEnum
 )
 from app.schemas import (
-    DocumentResponse, DocumentSummary, BudgetItemResponse,
-    CategorySummary, ImportJobResponse
+    DocumentResponse, DocumentSummary, BudgetItemResponse, ImportJobResponse
 )
+from app.summary import compute_document_summary
 from app.tasks import process_document
 from app.config import settings
 
@@ -28,6 +32,9 @@ Base.metadata.create_all(bind=engine)
 # Ensure storage directory exists
 os.makedirs(settings.STORAGE_PATH, exist_ok=True)
 
+# Uploads are written to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
 app = FastAPI(title="Budget Document API", version="1.0.0")
 
 # CORS middleware
@@ -40,8 +47,52 @@ app.add_middleware(
 )
 
 
+def _document_etag(document_id: uuid.UUID, version: int, *parts) -> str:
+    """Weak ETag for a view of a document, changing whenever its version is bumped."""
+    return 'W/"' + "-".join(str(part) for part in (document_id, version, *parts)) + '"'
+
+
+def _not_modified(request: Request, response: Response, etag: str) -> bool:
+    """
+    Tag the response with etag and report whether the client's copy is current.
+    
+    "no-cache" lets browsers keep the response but revalidate it on every use,
+    which costs a 304 without a body while the document is unchanged.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def _not_modified_response(etag: str) -> Response:
+    """Empty 304 answer for a matching If-None-Match."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+async def _save_upload(file: UploadFile, filepath: str) -> Tuple[int, str]:
+    """
+    Write an upload to disk in chunks, so the event loop keeps serving other
+    requests, hashing it on the way (the checksum is the PDF's ETag).
+    
+    Returns:
+        Tuple of (size in bytes, SHA-256 hex digest)
+    """
+    size_bytes = 0
+    sha256 = hashlib.sha256()
+    async with aiofiles.open(filepath, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+            sha256.update(chunk)
+            size_bytes += len(chunk)
+    return size_bytes, sha256.hexdigest()
+
+
 @app.post(f"{settings.API_V1_PREFIX}/documents/upload")
 async def upload_document(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     year: int = Query(..., description="Year of the budget document"),
     db: Session = Depends(get_db)
@@ -54,31 +105,46 @@ async def upload_document(
     doc_id = uuid.uuid4()
     filepath = os.path.join(settings.STORAGE_PATH, f"{doc_id}.pdf")
     
-    # Save file
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    logger.info(f"Saved uploaded file to {filepath}")
-    
-    # Create document record
+    # Create document record (size and checksum are filled in once the file is written)
     document = Document(
         id=doc_id,
         year=year,
         filename=file.filename,
         filepath=filepath
     )
-    db.add(document)
     
     # Create import job
     import_job = ImportJob(
         document_id=doc_id,
         status=ImportJobStatusEnum.PENDING
     )
-    db.add(import_job)
-    db.commit()
     
-    # Start background processing
-    process_document.delay(str(doc_id), str(import_job.id))
+    def insert_records():
+        db.add(document)
+        db.add(import_job)
+        db.flush()
+    
+    # Write the file and insert the rows concurrently; commit only when both succeeded
+    written, inserted = await asyncio.gather(
+        _save_upload(file, filepath),
+        run_in_threadpool(insert_records),
+        return_exceptions=True
+    )
+    for result in (written, inserted):
+        if isinstance(result, BaseException):
+            await run_in_threadpool(db.rollback)
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            raise result
+    
+    document.size_bytes, document.sha256 = written
+    await run_in_threadpool(db.commit)
+    logger.info("Saved uploaded file to {} ({} bytes)", filepath, document.size_bytes)
+    
+    # Start background processing; the broker round-trip runs after the response is sent
+    background.add_task(process_document.delay, str(doc_id), str(import_job.id))
     
     return {
         "document_id": doc_id,
@@ -90,198 +156,194 @@ async def upload_document(
 @app.get(f"{settings.API_V1_PREFIX}/documents", response_model=List[DocumentResponse])
 def list_documents(
     include_archived: bool = Query(False, description="Include archived documents"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_readonly_db)
 ):
     """List all documents. Archived documents are excluded by default."""
-    query = db.query(Document)
+    stmt = select(Document)
     if not include_archived:
-        query = query.filter(Document.archived == False)
-    documents = query.order_by(Document.year.desc()).all()
+        stmt = stmt.where(Document.archived == False)
+    documents = db.execute(stmt.order_by(Document.year.desc())).scalars().all()
     return documents
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}", response_model=DocumentResponse)
-def get_document(document_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_document(
+    document_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_readonly_db)
+):
     """Get a single document. Returns 404 if document is archived."""
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     if document.archived:
         raise HTTPException(status_code=404, detail="Document not found")
+    
+    etag = _document_etag(document_id, document.version)
+    if _not_modified(request, response, etag):
+        return _not_modified_response(etag)
     return document
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/summary", response_model=DocumentSummary)
-def get_document_summary(document_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_document_summary(
+    document_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_readonly_db)
+):
     """Get summary statistics for a document. Returns 404 if document is archived."""
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = db.get(Document, document_id, options=[undefer(Document.summary_json)])
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     if document.archived:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Get all items
-    items = db.query(BudgetItem).filter(BudgetItem.document_id == document_id).all()
-    
-    # Calculate totals
-    revenue_total = sum(
-        float(item.value) if item.value else 0
-        for item in items
-        if item.side == SideEnum.REVENUE
-    )
-    
-    expense_total = sum(
-        float(item.value) if item.value else 0
-        for item in items
-        if item.side == SideEnum.EXPENSE
-    )
-    
-    # Group by category
-    revenue_by_category = {}
-    expense_by_category = {}
-    
-    for item in items:
-        value = float(item.value) if item.value else 0
-        if item.side == SideEnum.REVENUE:
-            if item.category not in revenue_by_category:
-                revenue_by_category[item.category] = {"total": 0, "count": 0}
-            revenue_by_category[item.category]["total"] += value
-            revenue_by_category[item.category]["count"] += 1
-        else:
-            if item.category not in expense_by_category:
-                expense_by_category[item.category] = {"total": 0, "count": 0}
-            expense_by_category[item.category]["total"] += value
-            expense_by_category[item.category]["count"] += 1
+    # Unchanged document: skip the aggregation entirely
+    etag = _document_etag(document_id, document.version, "summary")
+    if _not_modified(request, response, etag):
+        return _not_modified_response(etag)
     
-    # Convert to response format
-    revenue_categories = [
-        CategorySummary(
-            category=cat,
-            total_value=data["total"],
-            item_count=data["count"]
-        )
-        for cat, data in revenue_by_category.items()
-    ]
-    
-    expense_categories = [
-        CategorySummary(
-            category=cat,
-            total_value=data["total"],
-            item_count=data["count"]
-        )
-        for cat, data in expense_by_category.items()
-    ]
-    
-    return DocumentSummary(
-        document_id=document_id,
-        year=document.year,
-        revenue_total=revenue_total,
-        expense_total=expense_total,
-        revenue_by_category=revenue_categories,
-        expense_by_category=expense_categories
-    )
+    # Materialized when processing finished; aggregated live while it still runs
+    if document.summary_json is not None:
+        return document.summary_json
+    return compute_document_summary(db, document_id, document.year)
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/categories/{{category}}", response_model=List[BudgetItemResponse])
 def get_category_items(
     document_id: uuid.UUID,
     category: CategoryEnum,
+    request: Request,
+    response: Response,
     sort_by: str = Query("value", description="Sort by: value, page_number, description"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_readonly_db)
 ):
     """Get all items for a specific category in a document. Returns 404 if document is archived."""
-    # Check if document exists and is not archived
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document or document.archived:
+    # Only the version is read before the ETag check, so a 304 skips the item query
+    version = db.execute(
+        select(Document.version).where(
+            Document.id == document_id,
+            Document.archived == False
+        )
+    ).scalar_one_or_none()
+    if version is None:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    query = db.query(BudgetItem).filter(
+    etag = _document_etag(document_id, version, category.name, sort_by)
+    if _not_modified(request, response, etag):
+        return _not_modified_response(etag)
+    
+    stmt = select(BudgetItem).where(
         BudgetItem.document_id == document_id,
         BudgetItem.category == category
     )
     
     if sort_by == "value":
-        query = query.order_by(BudgetItem.value.desc().nulls_last())
+        stmt = stmt.order_by(BudgetItem.value_cents.desc().nulls_last())
     elif sort_by == "page_number":
-        query = query.order_by(BudgetItem.page_number)
+        stmt = stmt.order_by(BudgetItem.page_number)
     elif sort_by == "description":
-        query = query.order_by(BudgetItem.description_original)
+        stmt = stmt.order_by(BudgetItem.description_original)
     
-    items = query.all()
-    return items
+    return db.execute(stmt).scalars().all()
 
 
 @app.get(f"{settings.API_V1_PREFIX}/items/{{item_id}}", response_model=BudgetItemResponse)
-def get_item(item_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_item(item_id: uuid.UUID, db: Session = Depends(get_readonly_db)):
     """Get a single budget item. Returns 404 if document is archived."""
-    item = db.query(BudgetItem).filter(BudgetItem.id == item_id).first()
+    item = db.execute(
+        select(BudgetItem).join(BudgetItem.document).where(
+            BudgetItem.id == item_id,
+            Document.archived == False
+        )
+    ).scalar_one_or_none()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    # Check if document is archived
-    document = db.query(Document).filter(Document.id == item.document_id).first()
-    if document and document.archived:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
     return item
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/pdf")
-def get_pdf(document_id: uuid.UUID, page: int = Query(None, description="Page number to jump to"), db: Session = Depends(get_db)):
+def get_pdf(document_id: uuid.UUID, page: int = Query(None, description="Page number to jump to"), db: Session = Depends(get_readonly_db)):
     """Serve the PDF file. Returns 404 if document is archived."""
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     if document.archived:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    if not os.path.exists(document.filepath):
+    # One stat per request: it both checks the file is still there and is
+    # reused by FileResponse for its Content-Length and Last-Modified headers
+    try:
+        file_stat = os.stat(document.filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="PDF file not found")
     
+    # Stored PDFs never change (one file per document id), so browsers may keep them
+    headers = {"Cache-Control": "public, max-age=86400, immutable"}
+    if document.sha256:
+        headers["ETag"] = f'"{document.sha256}"'
+    
+    # Behind Nginx: let it send the file from disk, the app never touches the bytes
+    if settings.PDF_X_ACCEL_REDIRECT_PREFIX:
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(document.filename)}"
+        headers["X-Accel-Redirect"] = settings.PDF_X_ACCEL_REDIRECT_PREFIX + os.path.basename(document.filepath)
+        return Response(media_type="application/pdf", headers=headers)
+    
     # Note: Browser PDF viewer may not support page parameter in URL fragment
     # This is a limitation of browser PDF viewers
     return FileResponse(
         document.filepath,
         media_type="application/pdf",
-        filename=document.filename
+        filename=document.filename,
+        headers=headers,
+        stat_result=file_stat
     )
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/pages/{{page_number}}")
-def get_page_text(document_id: uuid.UUID, page_number: int, db: Session = Depends(get_db)):
+def get_page_text(document_id: uuid.UUID, page_number: int, db: Session = Depends(get_readonly_db)):
     """Get raw extracted text for a specific page (debug endpoint). Returns 404 if document is archived."""
-    # Check if document exists and is not archived
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document or document.archived:
-        raise HTTPException(status_code=404, detail="Document not found")
-    
-    page = db.query(Page).filter(
-        Page.document_id == document_id,
-        Page.page_number == page_number
+    # Document check and page lookup in one round trip (NULL page text: no such page)
+    row = db.execute(
+        select(Page.text_raw).select_from(Document).outerjoin(
+            Page,
+            and_(Page.document_id == Document.id, Page.page_number == page_number)
+        ).where(
+            Document.id == document_id,
+            Document.archived == False
+        ).limit(1)
     ).first()
     
-    if not page:
+    if row is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if row.text_raw is None:
         raise HTTPException(status_code=404, detail="Page not found")
     
     return {
         "document_id": str(document_id),
         "page_number": page_number,
-        "text": page.text_raw
+        "text": row.text_raw
     }
 
 
 @app.get(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/import-jobs", response_model=List[ImportJobResponse])
-def get_import_jobs(document_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_import_jobs(document_id: uuid.UUID, db: Session = Depends(get_readonly_db)):
     """Get import jobs for a document. Returns 404 if document is archived."""
-    # Check if document exists and is not archived
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document or document.archived:
+    # One round trip, as in get_category_items
+    jobs = db.execute(
+        select(ImportJob).select_from(Document).outerjoin(
+            ImportJob, ImportJob.document_id == Document.id
+        ).where(
+            Document.id == document_id,
+            Document.archived == False
+        ).order_by(ImportJob.created_at.desc())
+    ).scalars().all()
+    if not jobs:
         raise HTTPException(status_code=404, detail="Document not found")
-    
-    jobs = db.query(ImportJob).filter(
-        ImportJob.document_id == document_id
-    ).order_by(ImportJob.created_at.desc()).all()
-    return jobs
+    return [job for job in jobs if job is not None]
 
 
 @app.patch(f"{settings.API_V1_PREFIX}/documents/{{document_id}}/archive")
@@ -296,9 +358,10 @@ def archive_document(
         raise HTTPException(status_code=404, detail="Document not found")
     
     document.archived = archived
+    document.version = Document.version + 1
     db.commit()
     
-    logger.info(f"Document {document_id} {'archived' if archived else 'unarchived'}")
+    logger.info("Document {} {}", document_id, "archived" if archived else "unarchived")
     return {
         "document_id": document_id,
         "archived": archived,
@@ -318,18 +381,19 @@ def purge_document(document_id: uuid.UUID, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Delete the PDF file if it exists
-    if os.path.exists(document.filepath):
-        try:
-            os.remove(document.filepath)
-            logger.info(f"Deleted PDF file: {document.filepath}")
-        except Exception as e:
-            logger.warning(f"Could not delete PDF file {document.filepath}: {e}")
+    try:
+        os.remove(document.filepath)
+        logger.info("Deleted PDF file: {}", document.filepath)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Could not delete PDF file {}: {}", document.filepath, e)
     
     # Delete the document (cascade will handle related records)
     db.delete(document)
     db.commit()
     
-    logger.info(f"Purged document {document_id} and all associated data")
+    logger.info("Purged document {} and all associated data", document_id)
     return {
         "document_id": document_id,
         "message": "Document and all associated data permanently deleted"
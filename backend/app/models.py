@@ -1,13 +1,12 @@
 """Database models for budget documents."""
 import uuid
-from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, String, Integer, Numeric, Text, ForeignKey, DateTime, Enum as SQLEnum, Boolean
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from typing import Optional
+from sqlalchemy import Column, String, Integer, BigInteger, Text, ForeignKey, DateTime, Enum as SQLEnum, Boolean, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import deferred, relationship
 from app.database import Base
 
-
 class SideEnum(str, Enum):
     """Budget side: revenue or expense."""
     REVENUE = "REVENUE"
@@ -50,6 +49,19 @@ class ImportJobStatusEnum(str, Enum):
     FAILED = "FAILED"
 
 
+def _enum_values(enum_cls) -> list:
+    """Database labels of an enum: the member values (e.g. 'Saúde'), not the names."""
+    return [member.value for member in enum_cls]
+
+
+# Column types for the PostgreSQL enum types created by the initial migration,
+# declared once and shared by every column using them
+SIDE_ENUM = SQLEnum(SideEnum, name="sideenum", values_callable=_enum_values)
+CATEGORY_ENUM = SQLEnum(CategoryEnum, name="categoryenum", values_callable=_enum_values)
+UNIT_ENUM = SQLEnum(UnitEnum, name="unitenum", values_callable=_enum_values)
+IMPORT_JOB_STATUS_ENUM = SQLEnum(ImportJobStatusEnum, name="importjobstatusenum", values_callable=_enum_values)
+
+
 class Document(Base):
     """Budget document (PDF)."""
     __tablename__ = "documents"
@@ -58,8 +70,13 @@ class Document(Base):
     year = Column(Integer, nullable=False, index=True)
     filename = Column(String, nullable=False)
     filepath = Column(String, nullable=False)
-    uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    size_bytes = Column(BigInteger, nullable=True)  # Recorded at upload
+    sha256 = Column(String(64), nullable=True)  # Hex digest of the PDF, recorded at upload
+    uploaded_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     archived = Column(Boolean, default=False, nullable=False, index=True)
+    version = Column(Integer, server_default="0", nullable=False)  # Bumped on every change (ETags)
+    # DocumentSummary written when processing finishes; only loaded by the summary endpoint
+    summary_json = deferred(Column(JSONB, nullable=True))
     
     # Relationships
     pages = relationship("Page", back_populates="document", cascade="all, delete-orphan")
@@ -98,22 +115,37 @@ class Section(Base):
 class BudgetItem(Base):
     """Extracted budget line item."""
     __tablename__ = "budget_items"
+    __table_args__ = (
+        Index("ix_budget_items_year_side_category", "year", "side", "category"),
+        Index("ix_budget_items_doc_side_cat", "document_id", "side", "category"),
+        Index("ix_budget_items_value_notnull", "value", postgresql_where=text("value IS NOT NULL")),
+        # Category listing, in each of its index-backed sort orders
+        Index("ix_budget_items_doc_cat_value", "document_id", "category", text("value DESC NULLS LAST")),
+        Index("ix_budget_items_doc_cat_page", "document_id", "category", "page_number"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False, index=True)
-    year = Column(Integer, nullable=False, index=True)
-    side = Column(SQLEnum(SideEnum), nullable=False, index=True)
-    category = Column(SQLEnum(CategoryEnum), nullable=False, index=True)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    side = Column(SIDE_ENUM, nullable=False)
+    category = Column(CATEGORY_ENUM, nullable=False)
     description_original = Column(Text, nullable=False)
-    value = Column(Numeric(20, 2), nullable=True)
-    unit = Column(SQLEnum(UnitEnum), nullable=False)
+    value_cents = Column("value", BigInteger, nullable=True)  # EUR cents
+    unit = Column(UNIT_ENUM, nullable=False)
     page_number = Column(Integer, nullable=False)
     evidence_text = Column(Text, nullable=False)
     explanation = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationships
     document = relationship("Document", back_populates="budget_items")
+    
+    @property
+    def value(self) -> Optional[float]:
+        """Value in EUR (stored as integer cents)."""
+        if self.value_cents is None:
+            return None
+        return self.value_cents / 100
 
 
 class ImportJob(Base):
@@ -122,10 +154,10 @@ class ImportJob(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False, index=True)
-    status = Column(SQLEnum(ImportJobStatusEnum), default=ImportJobStatusEnum.PENDING, nullable=False)
-    progress = Column(Integer, default=0, nullable=False)  # 0-100
+    status = Column(IMPORT_JOB_STATUS_ENUM, default=ImportJobStatusEnum.PENDING, nullable=False)
+    progress = Column(Integer, server_default="0", nullable=False)  # 0-100
     error_message = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationships
     document = relationship("Document", back_populates="import_jobs")
@@ -1,94 +1,282 @@
 """PDF text extraction and section detection."""
+import re
+import statistics
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import fitz  # PyMuPDF
-from typing import List, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
 from loguru import logger
 
+T = TypeVar("T")
 
-def extract_pages(pdf_path: str) -> List[str]:
+
+# Open documents kept per worker process (least recently used are closed first)
+DOC_CACHE_SIZE = 4
+
+# Lines set in a font this much larger than the document's median size are heading candidates
+HEADING_FONT_RATIO = 1.15
+
+# Lines of heading length: 1-100 characters once stripped (group 1 is the stripped line)
+_HEADING_CANDIDATE_RE = re.compile(r"^[^\S\n]*(\S(?:[^\n]{0,98}\S)?)[^\S\n]*$", re.MULTILINE)
+# Section numbers before the first "." of a numbered heading ("IV. Receitas", "3. Despesas")
+_ROMAN_NUMERALS = frozenset(("I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X"))
+_ARABIC_NUMERALS = frozenset("123456789")
+# Deletes every character str.isdigit() accepts: a word contains a digit when
+# translating it changes it (one C call instead of a per-character generator)
+_DIGIT_TABLE = str.maketrans("", "", "".join(c for c in map(chr, range(sys.maxunicode + 1)) if c.isdigit()))
+
+
+# Open documents by path, each with the lock serializing its use (a fitz.Document
+# is not thread-safe); _DOC_CACHE_LOCK guards the mapping only, never a document
+_DOC_CACHE: "OrderedDict[str, Tuple[fitz.Document, threading.Lock]]" = OrderedDict()
+_DOC_CACHE_LOCK = threading.Lock()
+
+
+def _evict_docs() -> None:
+    """Drop the least recently used documents beyond DOC_CACHE_SIZE (cache lock held)."""
+    while len(_DOC_CACHE) > DOC_CACHE_SIZE:
+        _, (doc, lock) = _DOC_CACHE.popitem(last=False)
+        # A document in use is closed by its user when it is done with it
+        if lock.acquire(blocking=False):
+            doc.close()
+            lock.release()
+
+
+@contextmanager
+def open_doc(pdf_path: str) -> Iterator[fitz.Document]:
     """
-    Extract text from each page of a PDF.
+    Open a PDF through the per-process LRU of open documents.
+    
+    Re-reading a recently used PDF (task retries, page re-reads) skips
+    parsing its xref table and page tree again. A fitz.Document is not
+    thread-safe, so each document is used by one caller at a time; callers
+    reading different documents do not wait for each other.
     
     Args:
         pdf_path: Path to PDF file
         
-    Returns:
-        List of text strings, one per page
+    Yields:
+        Open fitz.Document (owned by the cache; do not close it)
     """
-    pages_text = []
+    with _DOC_CACHE_LOCK:
+        entry = _DOC_CACHE.get(pdf_path)
+        if entry is not None:
+            _DOC_CACHE.move_to_end(pdf_path)
+    
+    if entry is None:
+        # Parse outside the cache lock; another caller may cache the same file meanwhile
+        opened = (fitz.open(pdf_path), threading.Lock())
+        with _DOC_CACHE_LOCK:
+            entry = _DOC_CACHE.setdefault(pdf_path, opened)
+            _DOC_CACHE.move_to_end(pdf_path)
+            _evict_docs()
+        if entry is not opened:
+            opened[0].close()
+    
+    doc, lock = entry
+    lock.acquire()
     try:
-        doc = fitz.open(pdf_path)
-        logger.info(f"Opened PDF with {len(doc)} pages")
+        if doc.is_closed:
+            # Evicted and closed since the lookup: read a private copy
+            with fitz.open(pdf_path) as private_doc:
+                yield private_doc
+        else:
+            yield doc
+    finally:
+        with _DOC_CACHE_LOCK:
+            if _DOC_CACHE.get(pdf_path) is not entry and not doc.is_closed:
+                # Evicted while in use; the evicting caller left closing it to us
+                doc.close()
+            lock.release()
+
+
+def close_cached_docs() -> None:
+    """Close every document in the per-process cache (worker shutdown)."""
+    with _DOC_CACHE_LOCK:
+        while _DOC_CACHE:
+            _, (doc, lock) = _DOC_CACHE.popitem()
+            # A document in use is closed by its user when it is done with it
+            if lock.acquire(blocking=False):
+                doc.close()
+                lock.release()
+
+
+def _page_text(page: fitz.Page) -> str:
+    """Plain text of a page."""
+    return page.get_text()
+
+
+def _page_lines(page: fitz.Page) -> List[Tuple[str, float]]:
+    """Text and font size (largest span) of each line of a page, in get_text() order."""
+    lines = []
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block["lines"]:
+            spans = line["spans"]
+            text = "".join(span["text"] for span in spans)
+            lines.append((text, max((span["size"] for span in spans), default=0.0)))
+    return lines
+
+
+def _map_pages(pdf_path: str, extract_page: Callable[[fitz.Page], T]) -> List[T]:
+    """
+    Run extract_page on every page of a PDF, in page order.
+    
+    Pages are extracted sequentially: PyMuPDF does not support Python
+    threads, and documents are already processed in parallel across the
+    Celery worker processes.
+    
+    Args:
+        pdf_path: Path to PDF file
+        extract_page: Function of one page
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text()
-            pages_text.append(text)
+    Returns:
+        List of results, one per page
+    """
+    try:
+        with open_doc(pdf_path) as doc:
+            logger.info(f"Opened PDF with {len(doc)} pages")
+            results = []
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                results.append(extract_page(page))
         
-        doc.close()
-        logger.info(f"Extracted text from {len(pages_text)} pages")
-        return pages_text
+        logger.info(f"Extracted text from {len(results)} pages")
+        return results
     except Exception as e:
         logger.error(f"Error extracting PDF pages: {e}")
         raise
 
 
-def is_heading_line(line: str, context: dict) -> bool:
+def extract_pages(pdf_path: str) -> List[str]:
     """
-    Heuristic to identify heading-like lines.
+    Extract text from each page of a PDF.
     
-    A heading is likely:
-    - Short (less than 100 chars)
-    - Has uppercase words or title case
-    - Doesn't start with numbers (unless it's a section number)
-    - Not a table row (doesn't have multiple numbers)
+    Args:
+        pdf_path: Path to PDF file
+        
+    Returns:
+        List of text strings, one per page
+    """
+    return _map_pages(pdf_path, _page_text)
+
+
+def extract_pages_with_headings(pdf_path: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    Extract text and font-based heading candidates from each page of a PDF.
+    
+    A single structured ("dict") MuPDF pass per page yields both the page text
+    (identical to get_text()) and the font size of every line. Lines set in a
+    font clearly larger than the document's median size are heading candidates.
     
     Args:
-        line: Text line to check
-        context: Dict with stats about previous lines (for adaptive thresholds)
+        pdf_path: Path to PDF file
         
     Returns:
-        True if line looks like a heading
+        Tuple of (text per page, heading candidate lines per page). The candidate
+        lists are all empty when the document uses a single font size.
+    """
+    pages_lines = _map_pages(pdf_path, _page_lines)
+    pages_text = ["".join(f"{text}\n" for text, _ in lines) for lines in pages_lines]
+    
+    sizes = [size for lines in pages_lines for text, size in lines if text.strip()]
+    if not sizes:
+        return pages_text, [[] for _ in pages_lines]
+    threshold = statistics.median(sizes) * HEADING_FONT_RATIO
+    headings = [
+        [text for text, size in lines if size >= threshold and text.strip()]
+        for lines in pages_lines
+    ]
+    return pages_text, headings
+
+
+def _heading_level(line: str) -> int:
     """
-    line = line.strip()
+    Heading level of a stripped heading line.
     
+    Simplified: without font sizes, shorter and more prominent headings are
+    taken as higher-level ones.
+    """
+    length = len(line)
+    # 1 below 30 characters, 2 below 50, 3 otherwise
+    return 1 + (length >= 30) + (length >= 50)
+
+
+def _classify_font_line(line: str) -> int:
+    """Classify a stripped font-based heading candidate: 0 if too long or empty, else its level."""
+    if not 0 < len(line) <= 100:
+        return 0
+    return _heading_level(line)
+
+
+def _classify_line(line: str) -> int:
+    """Classify a stripped line: 0 if it is not heading-like, else its level (1-3)."""
     # Too long to be a heading
     if len(line) > 100:
-        return False
+        return 0
     
     # Empty or just whitespace
     if not line:
-        return False
+        return 0
     
-    # Too many numbers suggests it's a table row
+    # One pass over the words: count words with numbers (too many suggests a
+    # table row) and words that start uppercase (title case pattern)
     words = line.split()
-    num_count = sum(1 for w in words if any(c.isdigit() for c in w))
-    if num_count > 3:
-        return False
+    num_count = 0
+    upper_start = 0
+    for w in words:
+        if w[0].isupper():
+            upper_start += 1
+        if w.translate(_DIGIT_TABLE) != w:
+            num_count += 1
+            if num_count > 3:
+                return 0
     
-    # Check for uppercase/title case pattern
-    # Headings often have first letter of each word capitalized
-    words = line.split()
-    if len(words) > 0:
-        # Count words that start with uppercase
-        upper_start = sum(1 for w in words if w and w[0].isupper())
-        # If most words start uppercase, likely a heading
-        if len(words) <= 5 and upper_start >= len(words) * 0.6:
-            return True
+    # Headings often have first letter of each word capitalized:
+    # if most words start uppercase, likely a heading
+    if len(words) <= 5 and upper_start >= len(words) * 0.6:
+        return _heading_level(line)
     
     # Check for all caps (common in government documents)
     if line.isupper() and len(line) > 5 and len(line) < 80:
-        return True
+        return _heading_level(line)
     
-    # Check for common heading patterns (Roman numerals, numbered sections)
-    if line.startswith(("I.", "II.", "III.", "IV.", "V.", "VI.", "VII.", "VIII.", "IX.", "X.")):
-        return True
-    if line.startswith(("1.", "2.", "3.", "4.", "5.", "6.", "7.", "8.", "9.")) and len(line) < 60:
-        return True
+    # Check for common heading patterns (Roman numerals, numbered sections):
+    # one set lookup on the text before the first "."
+    number, dot, _ = line.partition(".")
+    if dot and number in _ROMAN_NUMERALS:
+        return _heading_level(line)
+    if dot and number in _ARABIC_NUMERALS and len(line) < 60:
+        return _heading_level(line)
     
-    return False
+    return 0
 
 
-def build_sections(pages_text: List[str]) -> List[Tuple[str, int, int]]:
+def is_heading_line(line: str, context: dict) -> bool:
+    """
+    Heuristic to identify heading-like lines.
+    
+    A heading is likely:
+    - Short (less than 100 chars)
+    - Has uppercase words or title case
+    - Doesn't start with numbers (unless it's a section number)
+    - Not a table row (doesn't have multiple numbers)
+    
+    Args:
+        line: Text line to check
+        context: Dict with stats about previous lines (for adaptive thresholds)
+        
+    Returns:
+        True if line looks like a heading
+    """
+    return _classify_line(line.strip()) > 0
+
+
+def build_sections(
+    pages_text: List[str],
+    headings: Optional[List[List[str]]] = None
+) -> List[Tuple[str, int, int]]:
     """
     Build sections from pages by detecting headings.
     
@@ -97,8 +285,13 @@ def build_sections(pages_text: List[str]) -> List[Tuple[str, int, int]]:
     - Maintain a title stack (breadcrumb path)
     - Group consecutive pages under the same heading
     
+    When font-based heading candidates are given (and the document has any),
+    only those lines are scanned; otherwise every line goes through the text
+    heuristics of is_heading_line.
+    
     Args:
         pages_text: List of text strings, one per page
+        headings: Optional heading candidate lines per page (from extract_pages_with_headings)
         
     Returns:
         List of tuples: (title_path, page_start, page_end)
@@ -109,34 +302,30 @@ def build_sections(pages_text: List[str]) -> List[Tuple[str, int, int]]:
     current_section_start = 0
     current_path = ""
     
-    logger.info(f"Building sections from {len(pages_text)} pages")
+    use_fonts = bool(headings) and any(headings)
+    classify = _classify_font_line if use_fonts else _classify_line
+    logger.info(f"Building sections from {len(pages_text)} pages ({'font' if use_fonts else 'text'} headings)")
     
     for page_idx, page_text in enumerate(pages_text):
-        lines = page_text.split('\n')
+        if use_fonts:
+            lines = headings[page_idx]
+        else:
+            # One regex pass finds the lines short enough to be headings; only
+            # those go through the (slower) heading heuristics
+            lines = (match.group(1) for match in _HEADING_CANDIDATE_RE.finditer(page_text))
         page_has_heading = False
         new_heading = None
         new_level = None
         
         # Scan lines for headings
         for line in lines:
-            if is_heading_line(line, {}):
-                # Determine heading level (simplified: by indentation or position)
-                # In practice, we could use font size, but for text-only we use position
-                stripped = line.strip()
-                
-                # Simple level detection: if it's shorter and more prominent, it's higher level
-                if len(stripped) < 30:
-                    level = 1
-                elif len(stripped) < 50:
-                    level = 2
-                else:
-                    level = 3
-                
+            stripped = line.strip()
+            level = classify(stripped)
+            if level:
                 # If we find a heading at a higher or same level, start a new section
                 if not title_stack or level <= len(title_stack):
-                    # Pop stack to appropriate level
-                    while len(title_stack) >= level:
-                        title_stack.pop()
+                    # Pop stack to appropriate level (one slice deletion)
+                    del title_stack[level - 1:]
                     
                     title_stack.append(stripped)
                     new_heading = stripped
@@ -18,6 +18,7 @@ class DocumentCreate(DocumentBase):
 class DocumentResponse(DocumentBase):
     id: uuid.UUID
     filename: str
+    size_bytes: Optional[int] = None
     uploaded_at: datetime
     archived: bool = False
     
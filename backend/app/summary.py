@@ -0,0 +1,57 @@
+"""Document summary aggregation (totals per side and category)."""
+import uuid
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.models import BudgetItem, SideEnum
+from app.schemas import CategorySummary, DocumentSummary
+
+
+def compute_document_summary(db: Session, document_id: uuid.UUID, year: int) -> DocumentSummary:
+    """
+    Aggregate a document's budget items in the database: one row per (side, category).
+    
+    Args:
+        db: Database session
+        document_id: UUID of the document
+        year: Year of the document
+        
+    Returns:
+        Document summary (values in EUR)
+    """
+    rows = db.execute(
+        select(
+            BudgetItem.side,
+            BudgetItem.category,
+            func.coalesce(func.sum(BudgetItem.value_cents), 0),
+            func.count()
+        ).where(
+            BudgetItem.document_id == document_id
+        ).group_by(BudgetItem.side, BudgetItem.category)
+    ).all()
+    
+    # Convert to response format (sums are in cents)
+    revenue_categories = []
+    expense_categories = []
+    revenue_cents = 0
+    expense_cents = 0
+    for side, category, total_cents, count in rows:
+        summary = CategorySummary(
+            category=category,
+            total_value=total_cents / 100,
+            item_count=count
+        )
+        if side == SideEnum.REVENUE:
+            revenue_categories.append(summary)
+            revenue_cents += total_cents
+        else:
+            expense_categories.append(summary)
+            expense_cents += total_cents
+    
+    return DocumentSummary(
+        document_id=document_id,
+        year=year,
+        revenue_total=revenue_cents / 100,
+        expense_total=expense_cents / 100,
+        revenue_by_category=revenue_categories,
+        expense_by_category=expense_categories
+    )
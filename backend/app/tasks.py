@@ -1,15 +1,20 @@
 """Celery tasks for background processing."""
 import os
-from decimal import Decimal
+import uuid
+from typing import List, Optional, Tuple
+import redis
+from sqlalchemy import case, func, insert, select, update
 from sqlalchemy.orm import Session
-from celery import Celery
+from celery import Celery, chord
+from celery.signals import worker_process_shutdown
 from loguru import logger
 from app.database import SessionLocal
 from app.models import (
     Document, Page, Section, BudgetItem, ImportJob,
     ImportJobStatusEnum, SideEnum, UnitEnum
 )
-from app.pdf_parser import extract_pages, build_sections
+from app.pdf_parser import extract_pages, extract_pages_with_headings, build_sections, close_cached_docs
+from app.summary import compute_document_summary
 from app.llm.client import llm_client
 from app.config import settings
 
@@ -28,20 +33,119 @@ celery_app.conf.update(
 )
 
 
+@worker_process_shutdown.connect
+def close_pdf_documents(**kwargs):
+    """Close the PDFs kept open by this worker process."""
+    close_cached_docs()
 
-def normalize_to_eur(value: float, unit: UnitEnum) -> float:
-    """Convert value to EUR for comparisons."""
+
+# Budget items are inserted with one multi-row INSERT per this many rows
+ITEM_INSERT_BATCH = 500
+
+# Count of finished sections per import job, shared by the section tasks
+_progress_redis = redis.from_url(settings.REDIS_URL)
+SECTIONS_DONE_TTL = 24 * 3600  # Seconds
+
+
+def _sections_done_key(import_job_id: str) -> str:
+    """Redis key counting the finished sections of an import job."""
+    return f"import:{import_job_id}:sections_done"
+
+
+# EUR cents per unit of an extracted value (UNKNOWN: assume EUR)
+_CENTS_PER_UNIT = {
+    UnitEnum.EUR: 100,
+    UnitEnum.THOUSAND_EUR: 100_000,
+    UnitEnum.MILLION_EUR: 100_000_000,
+}
+
+
+def normalize_to_eur_cents(value: Optional[float], unit: UnitEnum) -> Optional[int]:
+    """Convert value to whole EUR cents for storage and comparisons (None stays None)."""
     if value is None:
-        return 0.0
+        return None
+    # One multiplication by the combined factor, rounded once
+    return round(value * _CENTS_PER_UNIT.get(unit, 100))
+
+
+def _plan_section_batches(
+    db: Session, document_id: uuid.UUID, sections_data: List[Tuple[str, int, int]]
+) -> List[List[int]]:
+    """
+    Group consecutive sections into extraction batches.
+    
+    Short sections are grouped while their combined page text stays within
+    settings.LLM_MAX_INPUT_CHARS; a longer section forms a batch of its own.
+    The plan only needs the page lengths, not the text.
+    
+    Returns:
+        Lists of section indexes
+    """
+    page_lengths = dict(db.execute(
+        select(Page.page_number, func.length(Page.text_raw)).where(Page.document_id == document_id)
+    ).all())
+    
+    batches = []
+    batch = []
+    batch_chars = 0
+    for section_idx, (_, page_start, page_end) in enumerate(sections_data):
+        # Sections are 0-based; stored page numbers are 1-based
+        section_chars = sum(page_lengths.get(n, 0) for n in range(page_start + 1, page_end + 2))
+        if batch and batch_chars + section_chars > settings.LLM_MAX_INPUT_CHARS:
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append(section_idx)
+        batch_chars += section_chars
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _load_section_batch(db: Session, document_id: str, sections: List[list]) -> List[Tuple[int, str, str]]:
+    """
+    Load the text of a planned batch of sections.
+    
+    A batch covers a contiguous page range, read back from the database with
+    a single query and sliced into the sections' texts with page markers.
+    
+    Args:
+        db: Database session
+        document_id: UUID of the document
+        sections: List of [section_idx, title_path, page_start, page_end] (0-based pages)
+        
+    Returns:
+        List of (section_idx, title_path, pages_text)
+    """
+    first_page = sections[0][2] + 1
+    last_page = sections[-1][3] + 1
+    pages = dict(db.execute(
+        select(Page.page_number, Page.text_raw)
+        .where(
+            Page.document_id == document_id,
+            Page.page_number.between(first_page, last_page)
+        )
+    ).all())
     
-    if unit == UnitEnum.EUR:
-        return float(value)
-    elif unit == UnitEnum.THOUSAND_EUR:
-        return float(value) * 1000
-    elif unit == UnitEnum.MILLION_EUR:
-        return float(value) * 1000000
-    else:
-        return float(value)  # UNKNOWN: assume EUR
+    loaded = []
+    for section_idx, title_path, page_start, page_end in sections:
+        pages_text = "\n\n".join(
+            f"--- PAGE {n} ---\n{pages[n]}"
+            for n in range(page_start + 1, page_end + 2)
+            if n in pages
+        )
+        loaded.append((section_idx, title_path, pages_text))
+    return loaded
+
+
+def _mark_job_failed(db: Session, import_job_id: str, error_message: str) -> None:
+    """Mark an import job as failed (after rolling back the session's pending work)."""
+    db.rollback()
+    job = db.query(ImportJob).filter(ImportJob.id == import_job_id).first()
+    if job:
+        job.status = ImportJobStatusEnum.FAILED
+        job.error_message = error_message
+        db.commit()
 
 
 @celery_app.task(bind=True)
@@ -79,117 +183,189 @@ def process_document(self, document_id: str, import_job_id: str):
         
         # Step 1: Extract pages (10% progress)
         logger.info("Step 1: Extracting pages...")
-        pages_text = extract_pages(document.filepath)
-        
-        # Store pages in database
-        for page_num, text in enumerate(pages_text, start=1):
-            page = Page(
-                document_id=document.id,
-                page_number=page_num,
-                text_raw=text
-            )
-            db.add(page)
-        db.commit()
-        logger.info(f"Stored {len(pages_text)} pages")
+        if settings.PDF_FONT_HEADINGS:
+            pages_text, headings = extract_pages_with_headings(document.filepath)
+        else:
+            pages_text, headings = extract_pages(document.filepath), None
         
+        # Store pages in database (one bulk INSERT, no ORM instances)
+        db.execute(insert(Page), [
+            {"document_id": document.id, "page_number": page_num, "text_raw": text}
+            for page_num, text in enumerate(pages_text, start=1)
+        ])
         job.progress = 10
         db.commit()
+        logger.info(f"Stored {len(pages_text)} pages")
         
         # Step 2: Build sections (20% progress)
         logger.info("Step 2: Building sections...")
-        sections_data = build_sections(pages_text)
+        sections_data = build_sections(pages_text, headings)
         
         # Store sections
-        for title_path, page_start, page_end in sections_data:
-            section = Section(
-                document_id=document.id,
-                title_path=title_path,
-                page_start=page_start + 1,  # Convert 0-based to 1-based
-                page_end=page_end + 1
-            )
-            db.add(section)
-        db.commit()
-        logger.info(f"Stored {len(sections_data)} sections")
-        
+        db.execute(insert(Section), [
+            {
+                "document_id": document.id,
+                "title_path": title_path,
+                "page_start": page_start + 1,  # Convert 0-based to 1-based
+                "page_end": page_end + 1
+            }
+            for title_path, page_start, page_end in sections_data
+        ])
         job.progress = 20
         db.commit()
+        logger.info(f"Stored {len(sections_data)} sections")
         
-        # Step 3: Extract items from each section (20-90% progress)
+        # Step 3: Extract items from each batch of sections (20-90% progress). The
+        # batches are independent tasks spread over the worker pool; once all are
+        # done, finalize_document completes the import
         total_sections = len(sections_data)
-        items_processed = 0
+        batches = _plan_section_batches(db, document.id, sections_data)
         
-        for section_idx, (title_path, page_start, page_end) in enumerate(sections_data):
-            logger.info(f"Processing section {section_idx + 1}/{total_sections}: {title_path}")
-            
-            # Build text for this section with page markers
-            section_text_parts = []
-            for page_idx in range(page_start, page_end + 1):
-                if page_idx <= len(pages_text):
-                    page_text = pages_text[page_idx - 1]  # Convert to 0-based
-                    section_text_parts.append(f"--- PAGE {page_idx} ---\n{page_text}")
-            
-            pages_text_combined = "\n\n".join(section_text_parts)
-            
-            # Extract items using LLM
-            extracted_items = llm_client.extract_items(title_path, pages_text_combined)
-            
-            # Process each extracted item
-            for extracted in extracted_items:
-                # Categorize
-                category = llm_client.categorize_item(
-                    extracted.side,
-                    title_path,
-                    extracted.descriptionOriginal
-                )
-                
-                # Generate explanation
-                explanation = llm_client.explain_item(
-                    title_path,
-                    extracted.evidenceText
-                )
-                
-                # Normalize value to EUR for storage (keep original unit for display)
-                value_eur = None
-                if extracted.value is not None:
-                    value_eur = normalize_to_eur(extracted.value, extracted.unit)
-                
-                # Create budget item
-                budget_item = BudgetItem(
-                    document_id=document.id,
-                    year=document.year,
-                    side=extracted.side,
-                    category=category,
-                    description_original=extracted.descriptionOriginal,
-                    value=Decimal(str(value_eur)) if value_eur is not None else None,
-                    unit=extracted.unit,
-                    page_number=extracted.pageNumber,
-                    evidence_text=extracted.evidenceText,
-                    explanation=explanation
-                )
-                db.add(budget_item)
-                items_processed += 1
-            
-            # Update progress
-            progress = 20 + int((section_idx + 1) / total_sections * 70)
-            job.progress = progress
+        # The pages are stored now; drop their text so the worker does not hold
+        # the whole document while the batches are dispatched
+        del pages_text, headings
+        
+        _progress_redis.delete(_sections_done_key(import_job_id))
+        chord(
+            process_section_batch.s(
+                document_id,
+                import_job_id,
+                [[section_idx, *sections_data[section_idx]] for section_idx in batch],
+                total_sections
+            )
+            for batch in batches
+        )(finalize_document.s(document_id, import_job_id))
+        logger.info(f"Dispatched {len(batches)} section batches of document {document_id}")
+        
+    except Exception as e:
+        logger.error(f"Error processing document {document_id}: {e}", exc_info=True)
+        job = db.query(ImportJob).filter(ImportJob.id == import_job_id).first()
+        if job:
+            job.status = ImportJobStatusEnum.FAILED
+            job.error_message = str(e)
             db.commit()
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def process_section_batch(self, document_id: str, import_job_id: str, sections: List[list], total_sections: int) -> int:
+    """
+    Extract, categorize and store the budget items of a batch of consecutive sections.
+    
+    Args:
+        document_id: UUID of the document
+        import_job_id: UUID of the import job
+        sections: List of [section_idx, title_path, page_start, page_end] (0-based pages)
+        total_sections: Number of sections in the document (for progress)
+        
+    Returns:
+        Number of budget items stored
+    """
+    db: Session = SessionLocal()
+    
+    try:
+        year = db.execute(select(Document.year).where(Document.id == document_id)).scalar_one()
+        batch = _load_section_batch(db, document_id, sections)
+        for section_idx, title_path, _ in batch:
+            logger.info(f"Processing section {section_idx + 1}/{total_sections}: {title_path}")
+        
+        # Extract items using LLM (short consecutive sections share one request)
+        extracted_batch = llm_client.extract_items_batched([
+            (title_path, pages_text_combined) for _, title_path, pages_text_combined in batch
+        ])
+        section_items = [
+            (title_path, extracted)
+            for (_, title_path, _), extracted_items in zip(batch, extracted_batch)
+            for extracted in extracted_items
+        ]
+        
+        # Categorize and explain all items of the batch concurrently (one call per item)
+        annotations = llm_client.categorize_and_explain_items([
+            (extracted.side, title_path, extracted.descriptionOriginal, extracted.evidenceText)
+            for title_path, extracted in section_items
+        ])
+        
+        # Process each extracted item
+        budget_rows = []
+        for (title_path, extracted), (category, explanation) in zip(section_items, annotations):
+            # Budget item row (inserted in bulk)
+            budget_rows.append({
+                "document_id": document_id,
+                "year": year,
+                "side": extracted.side,
+                "category": category,
+                "description_original": extracted.descriptionOriginal,
+                # Normalized to EUR cents (keep original unit for display)
+                "value_cents": normalize_to_eur_cents(extracted.value, extracted.unit),
+                "unit": extracted.unit,
+                "page_number": extracted.pageNumber,
+                "evidence_text": extracted.evidenceText,
+                "explanation": explanation
+            })
+            if len(budget_rows) >= ITEM_INSERT_BATCH:
+                db.execute(insert(BudgetItem), budget_rows)
+                budget_rows.clear()
+        if budget_rows:
+            db.execute(insert(BudgetItem), budget_rows)
+        
+        # Update progress from the job-wide count of finished sections; batches
+        # finish in any order, so progress only ever moves forward
+        key = _sections_done_key(import_job_id)
+        sections_done = _progress_redis.incrby(key, len(sections))
+        _progress_redis.expire(key, SECTIONS_DONE_TTL)
+        progress = 20 + int(sections_done / total_sections * 70)
+        db.execute(
+            update(ImportJob)
+            .where(ImportJob.id == import_job_id)
+            .values(progress=case((ImportJob.progress < progress, progress), else_=ImportJob.progress))
+        )
+        # New items change the document's API responses
+        db.execute(update(Document).where(Document.id == document_id).values(version=Document.version + 1))
+        db.commit()
+        
+        return len(section_items)
+        
+    except Exception as e:
+        logger.exception(f"Error processing sections of document {document_id}: {e}")
+        # Fail the import; the chord does not run finalize_document after an error
+        _mark_job_failed(db, import_job_id, str(e))
+        raise
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True)
+def finalize_document(self, item_counts: List[int], document_id: str, import_job_id: str):
+    """
+    Complete an import once all section batches are stored.
+    
+    Args:
+        item_counts: Number of items stored by each section batch
+        document_id: UUID of the document
+        import_job_id: UUID of the import job
+    """
+    db: Session = SessionLocal()
+    
+    try:
+        logger.info(f"Processed {sum(item_counts)} budget items")
+        document = db.query(Document).filter(Document.id == document_id).first()
+        job = db.query(ImportJob).filter(ImportJob.id == import_job_id).first()
         
-        logger.info(f"Processed {items_processed} budget items")
+        # Materialize the summary, so GET /summary no longer aggregates the items
+        document.summary_json = compute_document_summary(db, document.id, document.year).model_dump(mode="json")
+        document.version = Document.version + 1
         
         # Finalize
         job.progress = 100
         job.status = ImportJobStatusEnum.DONE
         db.commit()
+        _progress_redis.delete(_sections_done_key(import_job_id))
         
         logger.info(f"Document {document_id} processing complete")
         
     except Exception as e:
-        logger.error(f"Error processing document {document_id}: {e}", exc_info=True)
-        job = db.query(ImportJob).filter(ImportJob.id == import_job_id).first()
-        if job:
-            job.status = ImportJobStatusEnum.FAILED
-            job.error_message = str(e)
-            db.commit()
+        logger.exception(f"Error finalizing document {document_id}: {e}")
+        _mark_job_failed(db, import_job_id, str(e))
     finally:
         db.close()
-
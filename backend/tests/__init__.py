@@ -0,0 +1,15 @@
+"""
+Backend tests (run from backend/: python -m unittest discover -s tests -t .).
+
+Settings are frozen once loaded, so the test configuration is set in the
+environment before any app module is imported: no LLM backend, no response
+cache and a throwaway storage directory.
+"""
+import os
+import tempfile
+
+os.environ["LLM_PROVIDER"] = "openai"
+os.environ["LLM_DISABLED"] = "false"
+os.environ.pop("OPENAI_API_KEY", None)
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["STORAGE_PATH"] = tempfile.mkdtemp(prefix="budget-tests-")
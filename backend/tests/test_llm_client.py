@@ -0,0 +1,174 @@
+"""Tests for item extraction in the LLM client."""
+import time
+import unittest
+from typing import Optional
+
+import httpx
+import orjson
+
+from app.llm.cache import LLMCache
+from app.llm.client import LLMClient, _EXTRACT_BATCH_SYSTEM_PROMPT
+from app.llm.providers import NUM_PREDICT, OllamaProvider, StreamTimeout
+
+
+def _item(description: str, page: int) -> dict:
+    return {
+        "side": "EXPENSE",
+        "descriptionOriginal": description,
+        "value": 1000,
+        "unit": "EUR",
+        "pageNumber": page,
+        "evidenceText": f"{description} 1000",
+    }
+
+
+class DictCache(LLMCache):
+    """In-memory response cache."""
+    
+    def __init__(self):
+        self.data = {}
+    
+    def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+    
+    def set(self, key: str, value: str) -> None:
+        self.data[key] = value
+
+
+class ExtractItemsBatchedTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.client = LLMClient()
+        self.client._cache = DictCache()
+        self.calls = []
+        self.streamed = []
+        self.client._stream = self._fake_stream
+        self.batch_answer = ""
+    
+    def _fake_stream(self, prompt, system_prompt, max_retries=3, num_predict=None):
+        if system_prompt == _EXTRACT_BATCH_SYSTEM_PROMPT:
+            self.calls.append(num_predict)
+            yield self.batch_answer
+            return
+        self.streamed.append(prompt)
+        yield orjson.dumps({"items": [_item("Saúde", 3)]}).decode()
+    
+    def _sections(self):
+        return [("A", "--- PAGE 1 ---\nA"), ("B", "--- PAGE 2 ---\nB"), ("C", "--- PAGE 3 ---\nC")]
+    
+    def test_complete_answer_is_cached(self):
+        self.batch_answer = orjson.dumps({"sections": [
+            {"section": 1, "items": [_item("Educação", 1)]},
+            {"section": 3, "items": [_item("Justiça", 3)]},
+        ]}).decode()
+        
+        results = self.client.extract_items_batched(self._sections())
+        
+        self.assertEqual([len(items) for items in results], [1, 0, 1])
+        self.assertEqual(self.calls, [NUM_PREDICT * 3])
+        self.assertEqual(self.streamed, [])
+        self.assertEqual(list(self.client._cache.data.values()), [self.batch_answer])
+    
+    def test_truncated_answer_keeps_completed_sections(self):
+        complete = orjson.dumps({"sections": [
+            {"section": 1, "items": [_item("Educação", 1)]},
+            {"section": 2, "items": [_item("Justiça", 2), _item("Defesa", 2)]},
+        ]}).decode()
+        # Cut off inside the second section's items
+        self.batch_answer = complete[:complete.index("Defesa")]
+        
+        results = self.client.extract_items_batched(self._sections())
+        
+        # Section 1 comes from the batched answer, 2 and 3 are extracted on their own
+        self.assertEqual([item.descriptionOriginal for item in results[0]], ["Educação"])
+        self.assertEqual([item.descriptionOriginal for item in results[1]], ["Saúde"])
+        self.assertEqual([item.descriptionOriginal for item in results[2]], ["Saúde"])
+        self.assertEqual(len(self.streamed), 2)
+        # The truncated answer is not cached (only the two single-section answers are)
+        self.assertNotIn(self.batch_answer, self.client._cache.data.values())
+        self.assertEqual(len(self.client._cache.data), 2)
+
+
+class SlowBatchTest(unittest.TestCase):
+    """A batched answer slower than the stream deadline, through a real Ollama provider."""
+    
+    def setUp(self):
+        self.client = LLMClient()
+        self.client._cache = DictCache()
+        
+        self.provider = OllamaProvider(
+            base_url="http://ollama.test", model="qwen2.5:3b-instruct", stream_max_time=0.2
+        )
+        self.provider._http = httpx.Client(transport=httpx.MockTransport(self._handler))
+        self.client.provider = self.provider
+        self.client._stream = self.provider.stream_call
+    
+    def _ndjson(self, text: str, done: bool = False) -> bytes:
+        return orjson.dumps({"message": {"content": text}, "done": done}) + b"\n"
+    
+    def _slow_batch(self):
+        answer = orjson.dumps({"sections": [
+            {"section": 1, "items": [_item("Educação", 1)]},
+            {"section": 2, "items": [_item("Justiça", 2)]},
+        ]}).decode()
+        cut = answer.index("Justiça")
+        yield self._ndjson(answer[:cut])
+        # Generation stalls past stream_max_time; the read timeout never triggers
+        time.sleep(0.3)
+        yield self._ndjson(answer[cut:], done=True)
+    
+    def _handler(self, request: httpx.Request) -> httpx.Response:
+        body = orjson.loads(request.content)
+        self.assertTrue(body["stream"])
+        if body["messages"][0]["content"] == _EXTRACT_BATCH_SYSTEM_PROMPT:
+            self.assertEqual(body["options"]["num_predict"], NUM_PREDICT * 2)
+            return httpx.Response(200, content=self._slow_batch())
+        answer = orjson.dumps({"items": [_item("Saúde", 2)]}).decode()
+        return httpx.Response(200, content=self._ndjson(answer, done=True))
+    
+    def test_slow_batch_does_not_trip_breaker(self):
+        sections = [("A", "--- PAGE 1 ---\nA"), ("B", "--- PAGE 2 ---\nB")]
+        
+        for _ in range(3):
+            results = self.client.extract_items_batched(sections)
+            # The section completed before the deadline is kept, the other re-extracted
+            self.assertEqual([item.descriptionOriginal for item in results[0]], ["Educação"])
+            self.assertEqual([item.descriptionOriginal for item in results[1]], ["Saúde"])
+        
+        self.assertTrue(self.provider._breaker.allow())
+        self.assertNotIn(False, self.provider._breaker._outcomes)
+        # Only the single-section answer was cached, never the cut-off batch
+        self.assertEqual(len(self.client._cache.data), 1)
+
+
+class IterExtractItemsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.client = LLMClient()
+        self.client._cache = DictCache()
+        self.answer = orjson.dumps({"items": [_item("Educação", 1), _item("Justiça", 1)]}).decode()
+    
+    def _extract(self, chunks):
+        self.client._stream = lambda prompt, system_prompt: iter(chunks)
+        return [item.descriptionOriginal for item in self.client.extract_items("A", "--- PAGE 1 ---\nA")]
+    
+    def test_complete_answer_is_cached(self):
+        self.assertEqual(self._extract(["```json\n", self.answer, "\n```"]), ["Educação", "Justiça"])
+        self.assertEqual(len(self.client._cache.data), 1)
+    
+    def test_truncated_answer_is_not_cached(self):
+        truncated = self.answer[:self.answer.index("Justiça")]
+        
+        self.assertEqual(self._extract([truncated[:40], truncated[40:]]), ["Educação"])
+        self.assertEqual(self.client._cache.data, {})
+    
+    def test_stream_cut_off_at_deadline_is_not_cached(self):
+        def stream(prompt, system_prompt):
+            yield self.answer[:self.answer.index("Justiça")]
+            raise StreamTimeout("stream exceeded 300s")
+        
+        self.client._stream = stream
+        items = self.client.extract_items("A", "--- PAGE 1 ---\nA")
+        
+        self.assertEqual([item.descriptionOriginal for item in items], ["Educação"])
+        self.assertEqual(self.client._cache.data, {})
@@ -0,0 +1,68 @@
+"""Tests for the API endpoints, with the database session replaced by a stub."""
+import os
+import unittest
+import uuid
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.database import get_readonly_db
+from app.models import Document
+
+# Importing the app creates the tables; no database is needed here
+with mock.patch("sqlalchemy.MetaData.create_all"):
+    from app.main import app
+
+
+class StubSession:
+    """Session stub returning fixed documents by id."""
+    
+    def __init__(self, documents):
+        self.documents = {document.id: document for document in documents}
+    
+    def get(self, model, ident):
+        return self.documents.get(ident)
+
+
+class GetPdfTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.document = Document(
+            id=uuid.uuid4(),
+            year=2024,
+            filename="orcamento.pdf",
+            filepath=os.path.join(settings.STORAGE_PATH, f"{uuid.uuid4()}.pdf"),
+            archived=False,
+        )
+        session = StubSession([self.document])
+        app.dependency_overrides[get_readonly_db] = lambda: session
+        self.client = TestClient(app)
+        self.url = f"{settings.API_V1_PREFIX}/documents/{self.document.id}/pdf"
+    
+    def tearDown(self):
+        app.dependency_overrides.clear()
+        if os.path.exists(self.document.filepath):
+            os.remove(self.document.filepath)
+    
+    def test_serves_stored_file(self):
+        with open(self.document.filepath, "wb") as f:
+            f.write(b"%PDF-1.4 test")
+        
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"%PDF-1.4 test")
+        self.assertEqual(response.headers["content-length"], "13")
+    
+    def test_missing_file_is_404(self):
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"detail": "PDF file not found"})
+    
+    def test_unknown_document_is_404(self):
+        response = self.client.get(f"{settings.API_V1_PREFIX}/documents/{uuid.uuid4()}/pdf")
+        
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"detail": "Document not found"})